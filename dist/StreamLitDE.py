@@ -1,42 +1,66 @@
 # StreamLitDE.py — Full app with background delivery listener & back buttons above inputs
 import streamlit as st
-import pandas as pd
-import serial
-import time
 import io
-from datetime import datetime, timedelta
-from streamlit_autorefresh import st_autorefresh
+import time
+from datetime import date, datetime, time as dtime, timedelta
 from openpyxl import Workbook
 
+import metrics
+from carts import PAGE_ROWS, CartRegistry
+from inventory import MAX_COUNT, MAX_SECTION
+from importer import MissingColumnsError, read_table_chunks
+
 # ---------------- CONFIG ----------------
-PICO_SERIAL_PORT = "COM9"
+CARTS = {"cart1": "COM9"}   # cart id -> Pico serial port; one process serves them all
 PICO_BAUDRATE = 115200
 NUM_SERVOS = 5
 AUTO_RELOCK_SECONDS = 20
 OUT_WARNING_MINUTES = 5
-REFRESH_INTERVAL_SEC = 3    # how often page auto-refreshes (seconds)
+REFRESH_INTERVAL_SEC = 3    # how often the alerts / cabinet panels refresh (seconds)
+INVENTORY_REFRESH_SEC = 10  # how often the inventory table refreshes (seconds)
 AUTHORIZED_CODES = ["1111", "2222"]
 MAIN_PASSCODE = "1234"
 DELIVERY_PREFIX = "C"       # Delivery scanner prefix
-
-# ---------------- AUTOREFRESH ----------------
-st_autorefresh(interval=REFRESH_INTERVAL_SEC * 1000, key="global_refresh")
+TXLOG_PATH = "cart_txlog_{cart}.sqlite3"   # durable event log per cart (SQLite, WAL mode)
+METRICS_ENABLED = True      # timing spans, counters and histograms (see metrics.py)
+METRICS_PORT = 9464         # Prometheus endpoint: http://127.0.0.1:9464/metrics (None to disable)
+METRICS_FILE = "cart_metrics.log"   # rotating JSON-lines trace file (None to disable)
+PROFILE_DIR = None          # e.g. "slow_reruns": keep cProfile captures of the slowest reruns
+DEFAULT_PATIENTS = {
+    "PATIENT123": {"Name": "John Doe", "Drugs": ["Morphine", "Aspirin"]},
+    "PATIENT456": {"Name": "Jane Smith", "Drugs": ["Ibuprofen"]},
+}
+
+# only the panels that change on their own rerun on a timer (see PANELS below)
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+# ---------------- SHARED CARTS ----------------
+@st.cache_resource
+def metrics_exporter():
+    """Metrics endpoint and trace file, started once per server process."""
+    return metrics.configure(METRICS_ENABLED, port=METRICS_PORT, path=METRICS_FILE, profile_dir=PROFILE_DIR)
+
+
+@st.cache_resource
+def cart_registry():
+    """Carts live once per server process; sessions only attach to one."""
+    return CartRegistry(
+        CARTS, baudrate=PICO_BAUDRATE, num_cabinets=NUM_SERVOS, auto_relock_seconds=AUTO_RELOCK_SECONDS,
+        out_warning_minutes=OUT_WARNING_MINUTES, log_path=TXLOG_PATH, default_patients=DEFAULT_PATIENTS,
+    )
+
+
+metrics_exporter()
+registry = cart_registry()
+# times this script run; scans handled below are traced under its correlation ID
+render = metrics.Rerun()
 
 # ---------------- SESSION STATE SETUP ----------------
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = False
 
-if "df" not in st.session_state:
-    st.session_state.df = pd.DataFrame(columns=[
-        "Drug", "Amount", "Barcode", "Actively Out", "Wasted",
-        "Delivered", "Needs Waste", "Cabinet", "Section", "Last Dispensed Time", "Assigned Patient"
-    ])
-
-if "patients" not in st.session_state:
-    st.session_state.patients = {
-        "PATIENT123": {"Name": "John Doe", "Drugs": ["Morphine", "Aspirin"]},
-        "PATIENT456": {"Name": "Jane Smith", "Drugs": ["Ibuprofen"]},
-    }
+if "cart_id" not in st.session_state:
+    st.session_state.cart_id = registry.ids()[0]
 
 # UI state
 if "menu" not in st.session_state:
@@ -50,20 +74,6 @@ if "awaiting_drug_scan" not in st.session_state:
 if "current_patient" not in st.session_state:
     st.session_state.current_patient = None
 
-# pico / cabinets
-if "pico" not in st.session_state:
-    st.session_state.pico = None
-if "pico_connected" not in st.session_state:
-    st.session_state.pico_connected = False
-if "cabinet_locked" not in st.session_state:
-    st.session_state.cabinet_locked = {i + 1: True for i in range(NUM_SERVOS)}
-if "unlock_expiries" not in st.session_state:
-    st.session_state.unlock_expiries = {}
-
-# last dispensed times (for alerts)
-if "last_dispensed" not in st.session_state:
-    st.session_state.last_dispensed = {}  # drug -> datetime
-
 
 # ---------------- HELPERS ----------------
 def show_dataframe(df):
@@ -73,10 +83,45 @@ def show_dataframe(df):
         st.dataframe(df, use_container_width=True)
 
 
+def get_cart():
+    """The cart this session is attached to."""
+    return registry.get(st.session_state.cart_id)
+
+
+def show_result(result):
+    """Show a cart method's (level, message); True when there was nothing to show."""
+    if result is None:
+        return True
+    level, message = result
+    getattr(st, level)(message)
+    return False
+
+
+def switch_cart():
+    st.session_state.menu = None
+    st.session_state.menu_stack = []
+    st.session_state.awaiting_drug_scan = False
+    st.session_state.current_patient = None
+
+
+def show_paged(df, key):
+    """Show one PAGE_ROWS slice of a large table with a page picker."""
+    pages = max(1, -(-len(df) // PAGE_ROWS))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key)
+    show_dataframe(df.iloc[(page - 1) * PAGE_ROWS: page * PAGE_ROWS])
+
+
+def rerun_page():
+    render.finish()
+    st.rerun()
+
+
 def enter_menu(name):
     st.session_state.menu_stack.append(st.session_state.menu)
     st.session_state.menu = name
-    st.rerun()
+    rerun_page()
 
 
 def go_back():
@@ -84,112 +129,56 @@ def go_back():
         st.session_state.menu = st.session_state.menu_stack.pop()
     else:
         st.session_state.menu = None
-    st.rerun()
+    rerun_page()
 
 
 def reset_main():
     st.session_state.menu = None
     st.session_state.menu_stack = []
-    st.rerun()
+    rerun_page()
 
 
 # ---------------- PICO / SERIAL ----------------
 def get_pico():
-    pico = st.session_state.pico
-    try:
-        if pico is not None and pico.is_open:
-            return pico
-    except Exception:
-        st.session_state.pico = None
-        st.session_state.pico_connected = False
-
-    try:
-        pico = serial.Serial(PICO_SERIAL_PORT, PICO_BAUDRATE, timeout=1)
-        time.sleep(0.1)
-        try:
-            pico.write(b"CONNECT\n")
-        except Exception:
-            pass
-        st.session_state.pico = pico
-        st.session_state.pico_connected = True
-        return pico
-    except Exception:
-        st.session_state.pico = None
-        st.session_state.pico_connected = False
-        return None
-
-
-def send_servo_command(cmd: str) -> bool:
-    pico = get_pico()
-    if pico is None:
-        return False
-    try:
-        pico.write((cmd + "\n").encode())
-        return True
-    except Exception:
-        st.session_state.pico = None
-        st.session_state.pico_connected = False
-        return False
+    """The serial worker for this session's cart; never blocks on the port."""
+    return get_cart().link
 
 
 def unlock_cabinet(cabinet_num: int):
-    if not (1 <= cabinet_num <= NUM_SERVOS):
-        return False
-    ok = send_servo_command(f"UNLOCK{cabinet_num}")
-    if ok:
-        st.session_state.cabinet_locked[cabinet_num] = False
-        st.session_state.unlock_expiries[cabinet_num] = datetime.now() + timedelta(seconds=AUTO_RELOCK_SECONDS)
-    return ok
+    return get_cart().unlock_cabinet(cabinet_num)
 
 
 def lock_cabinet(cabinet_num: int):
-    if not (1 <= cabinet_num <= NUM_SERVOS):
-        return False
-    ok = send_servo_command(f"LOCK{cabinet_num}")
-    if ok:
-        st.session_state.cabinet_locked[cabinet_num] = True
-        st.session_state.unlock_expiries.pop(cabinet_num, None)
-    return ok
+    return get_cart().lock_cabinet(cabinet_num)
 
 
 def unlock_all_cabinets():
-    any_ok = False
-    for i in range(1, NUM_SERVOS + 1):
-        ok = send_servo_command(f"UNLOCK{i}")
-        if ok:
-            any_ok = True
-            st.session_state.cabinet_locked[i] = False
-            st.session_state.unlock_expiries[i] = datetime.now() + timedelta(seconds=AUTO_RELOCK_SECONDS)
-    return any_ok
+    return get_cart().unlock_all()
 
 
-# ---------------- ALERTS & AUTO-RELOCK ----------------
+# ---------------- ALERTS ----------------
 def show_out_alerts_in_app():
-    now = datetime.now()
+    now = time.time()
     messages = []
-    for drug, ts in st.session_state.last_dispensed.items():
-        if ts and now - ts > timedelta(minutes=OUT_WARNING_MINUTES):
-            minutes = int((now - ts).total_seconds() // 60)
-            messages.append(f"🚨 **{drug}** — out for {minutes} minutes")
+    for drug, since in get_cart().overdue_alerts():
+        minutes = int((now - since) // 60)
+        messages.append(f"🚨 **{drug}** — out for {minutes} minutes")
     if messages:
         st.markdown(
             "<div style='background:#fff3cd;padding:12px;border-radius:8px;'>"
-            "<h4 style='color:#8a3b00;'>Outstanding: Drugs out > 5 minutes</h4>"
+            f"<h4 style='color:#8a3b00;'>Outstanding: Drugs out > {OUT_WARNING_MINUTES} minutes</h4>"
             + "<br>".join(messages) +
             "</div>",
             unsafe_allow_html=True,
         )
 
 
-def check_and_relock_expired():
-    now = datetime.now()
-    expired = [cab for cab, exp in st.session_state.unlock_expiries.items() if exp is not None and now >= exp]
-    for cab in expired:
-        if not st.session_state.cabinet_locked.get(cab, True):
-            ok = send_servo_command(f"LOCK{cab}")
-            if ok:
-                st.session_state.cabinet_locked[cab] = True
-        st.session_state.unlock_expiries.pop(cab, None)
+def show_log_health():
+    """Warn while the cart's audit log cannot be written (it keeps retrying)."""
+    log = get_cart().txlog
+    if log.last_error:
+        st.error(f"⚠️ Audit log not saved: {log.pending} events waiting to be written, retrying. "
+                 f"Last error: {log.last_error}")
 
 
 # ---------------- CSV / TEMPLATE HELPERS ----------------
@@ -220,80 +209,36 @@ def make_patient_template_bytes():
 
 def process_inventory_file(uploaded):
     try:
-        if uploaded.name.lower().endswith(".xlsx"):
-            new_df = pd.read_excel(uploaded)
-        else:
-            new_df = pd.read_csv(uploaded)
-    except Exception as e:
-        st.error(f"Could not read file: {e}")
+        report = get_cart().import_inventory(read_table_chunks(uploaded), uploaded.name)
+    except MissingColumnsError as e:
+        st.error(str(e))
         return
-
-    required = {"Drug", "Barcode", "Needs_Waste", "Cabinet", "Amount"}
-    if not required.issubset(set(new_df.columns)):
-        st.error(f"Inventory file must contain columns: {', '.join(sorted(required))}")
+    except Exception as e:
+        st.error(f"Could not read file; nothing was imported: {e}")
         return
 
-    df = st.session_state.df.copy()
-    for _, r in new_df.iterrows():
-        drug = str(r["Drug"])
-        barcode = str(r["Barcode"])
-        needs_waste = bool(r["Needs_Waste"])
-        cabinet = int(r["Cabinet"]) if pd.notnull(r["Cabinet"]) else 1
-        section = int(r.get("Section", 1)) if pd.notnull(r.get("Section", 1)) else 1
-        amount = int(r["Amount"]) if pd.notnull(r["Amount"]) else 0
-
-        if barcode in df["Barcode"].values:
-            idx = df.index[df["Barcode"] == barcode][0]
-            df.loc[idx, "Amount"] = int(df.loc[idx, "Amount"]) + amount
-            df.loc[idx, "Needs Waste"] = needs_waste
-            df.loc[idx, "Cabinet"] = cabinet
-            df.loc[idx, "Section"] = section
-        elif drug in df["Drug"].values:
-            idx = df.index[df["Drug"] == drug][0]
-            df.loc[idx, "Amount"] = int(df.loc[idx, "Amount"]) + amount
-            df.loc[idx, "Barcode"] = barcode or df.loc[idx, "Barcode"]
-            df.loc[idx, "Needs Waste"] = needs_waste
-            df.loc[idx, "Cabinet"] = cabinet
-            df.loc[idx, "Section"] = section
-        else:
-            new_row = {
-                "Drug": drug, "Amount": int(amount), "Barcode": barcode,
-                "Actively Out": 0, "Wasted": 0, "Delivered": 0,
-                "Needs Waste": needs_waste, "Cabinet": cabinet, "Section": section,
-                "Last Dispensed Time": None, "Assigned Patient": None
-            }
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-
-    st.session_state.df = df
-    st.success("Inventory merged — unlocking all cabinets for restock.")
+    st.success(f"Inventory merged ({report.summary()}) — unlocking all cabinets for restock.")
+    show_import_rejects(report)
     unlock_all_cabinets()
 
 
 def process_patients_file(uploaded):
     try:
-        if uploaded.name.lower().endswith(".xlsx"):
-            p_df = pd.read_excel(uploaded)
-        else:
-            p_df = pd.read_csv(uploaded)
+        report = get_cart().import_patients(read_table_chunks(uploaded), uploaded.name)
+    except MissingColumnsError as e:
+        st.error(str(e))
+        return
     except Exception as e:
-        st.error(f"Could not read patients file: {e}")
+        st.error(f"Could not read patients file; nothing was imported: {e}")
         return
+    st.success(f"Patient dictionary updated ({report.summary()}).")
+    show_import_rejects(report)
 
-    required = {"Patient", "Drug"}
-    if not required.issubset(set(p_df.columns)):
-        st.error("Patient file must contain columns: Patient, Drug")
-        return
 
-    for _, r in p_df.iterrows():
-        pid = str(r["Patient"])
-        drug = str(r["Drug"])
-        if pid in st.session_state.patients:
-            existing = set(st.session_state.patients[pid]["Drugs"])
-            existing.add(drug)
-            st.session_state.patients[pid]["Drugs"] = list(existing)
-        else:
-            st.session_state.patients[pid] = {"Name": pid, "Drugs": [drug]}
-    st.success("Patient dictionary updated.")
+def show_import_rejects(report):
+    if report.rejected_count:
+        with st.expander(f"⚠️ {report.rejected_count} rejected rows"):
+            show_dataframe(report.rejected_frame())
 
 
 # ---------------- BARCODE HANDLERS ----------------
@@ -301,103 +246,18 @@ def handle_cart_scan(scan: str, context: str = None):
     if not scan:
         return
     s = scan.strip()
-    df = st.session_state.df
-
-    # add_existing context
-    if context == "add_existing":
-        if s in df["Barcode"].values:
-            idx = df.index[df["Barcode"] == s][0]
-            df.loc[idx, "Amount"] = int(df.loc[idx, "Amount"]) + 1
-            st.session_state.df = df
-            try:
-                unlock_cabinet(int(df.loc[idx, "Cabinet"]))
-            except Exception:
-                pass
-            reset_main()
-        else:
-            st.error("Barcode not found; consider Add New.")
-        return
-
-    # dispense context
-    if context == "dispense":
-        if s in df["Barcode"].values:
-            idx = df.index[df["Barcode"] == s][0]
-            if int(df.loc[idx, "Amount"]) > 0:
-                df.loc[idx, "Amount"] = int(df.loc[idx, "Amount"]) - 1
-                df.loc[idx, "Actively Out"] = int(df.loc[idx, "Actively Out"]) + 1
-                df.loc[idx, "Last Dispensed Time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                st.session_state.df = df
-                st.session_state.last_dispensed[df.loc[idx, "Drug"]] = datetime.now()
-                try:
-                    unlock_cabinet(int(df.loc[idx, "Cabinet"]))
-                except Exception:
-                    pass
-                reset_main()
-            else:
-                st.warning("No stock available to dispense.")
-        else:
-            st.error("Barcode not found.")
-        return
-
-    # return context
-    if context == "return":
-        if s in df["Barcode"].values:
-            idx = df.index[df["Barcode"] == s][0]
-            if int(df.loc[idx, "Actively Out"]) > 0:
-                df.loc[idx, "Actively Out"] = int(df.loc[idx, "Actively Out"]) - 1
-                df.loc[idx, "Amount"] = int(df.loc[idx, "Amount"]) + 1
-                df.loc[idx, "Last Dispensed Time"] = None
-                st.session_state.df = df
-                try:
-                    lock_cabinet(int(df.loc[idx, "Cabinet"]))
-                except Exception:
-                    pass
-                reset_main()
-            else:
-                st.warning("No actively out units to return.")
-        else:
-            st.error("Barcode not found.")
-        return
 
-    # waste context
     if context == "waste":
         c1 = st.session_state.get("waste_code1", "")
         c2 = st.session_state.get("waste_code2", "")
         if c1 not in AUTHORIZED_CODES or c2 not in AUTHORIZED_CODES or c1 == c2:
             st.error("Invalid or duplicate authorization codes.")
             return
-        if s in df["Barcode"].values:
-            idx = df.index[df["Barcode"] == s][0]
-            if int(df.loc[idx, "Actively Out"]) > 0 and df.loc[idx, "Needs Waste"]:
-                df.loc[idx, "Actively Out"] = int(df.loc[idx, "Actively Out"]) - 1
-                df.loc[idx, "Wasted"] = int(df.loc[idx, "Wasted"]) + 1
-                if int(df.loc[idx, "Actively Out"]) == 0:
-                    df.loc[idx, "Last Dispensed Time"] = None
-                st.session_state.df = df
-                reset_main()
-            else:
-                st.info("Nothing to waste or waste not required.")
-        else:
-            st.error("Barcode not found.")
-        return
 
-    # generic quick dispense
-    if s in df["Barcode"].values:
-        idx = df.index[df["Barcode"] == s][0]
-        if int(df.loc[idx, "Amount"]) > 0:
-            df.loc[idx, "Amount"] = int(df.loc[idx, "Amount"]) - 1
-            df.loc[idx, "Actively Out"] = int(df.loc[idx, "Actively Out"]) + 1
-            df.loc[idx, "Last Dispensed Time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            st.session_state.df = df
-            st.session_state.last_dispensed[df.loc[idx, "Drug"]] = datetime.now()
-            try:
-                unlock_cabinet(int(df.loc[idx, "Cabinet"]))
-            except Exception:
-                pass
-        else:
-            st.warning("No stock to dispense.")
-    else:
-        st.error("Barcode not found in inventory.")
+    ok = show_result(get_cart().scan(s, context))
+    # menu scans go back to the main screen; quick dispense stays put
+    if ok and context is not None:
+        reset_main()
 
 
 def handle_delivery_scan(raw_scan: str):
@@ -410,7 +270,7 @@ def handle_delivery_scan(raw_scan: str):
     else:
         code = s
 
-    df = st.session_state.df
+    cart = get_cart()
 
     # If another panel is active, ignore (we only listen on main)
     if st.session_state.menu is not None:
@@ -418,7 +278,7 @@ def handle_delivery_scan(raw_scan: str):
 
     # If not awaiting drug, treat as patient id
     if not st.session_state.awaiting_drug_scan:
-        if code in st.session_state.patients:
+        if cart.has_patient(code):
             st.session_state.current_patient = code
             st.session_state.awaiting_drug_scan = True
             # silent wait — do not show success UI
@@ -429,22 +289,8 @@ def handle_delivery_scan(raw_scan: str):
     else:
         # expecting drug scan
         patient_id = st.session_state.current_patient
-        if code in df["Barcode"].values:
-            idx = df.index[df["Barcode"] == code][0]
-            drug_name = df.loc[idx, "Drug"]
-            if drug_name in st.session_state.patients.get(patient_id, {}).get("Drugs", []):
-                # mark delivered
-                if int(df.loc[idx, "Actively Out"]) > 0:
-                    df.loc[idx, "Actively Out"] = int(df.loc[idx, "Actively Out"]) - 1
-                df.loc[idx, "Delivered"] = int(df.loc[idx, "Delivered"] if pd.notna(df.loc[idx, "Delivered"]) else 0) + 1
-                df.loc[idx, "Last Dispensed Time"] = None
-                df.loc[idx, "Assigned Patient"] = patient_id
-                st.session_state.df = df
-                # success silent
-            else:
-                st.warning(f"Delivery warning: {drug_name} not prescribed for {patient_id}")
-        else:
-            st.warning("Delivery scan: drug barcode not found.")
+        # mark delivered; success silent
+        show_result(cart.deliver(patient_id, code))
         # reset delivery state
         st.session_state.awaiting_drug_scan = False
         st.session_state.current_patient = None
@@ -454,26 +300,21 @@ def handle_delivery_scan(raw_scan: str):
 st.set_page_config(page_title="Hospital Cart OS", layout="wide")
 st.title("🏥 Hospital Cart OS — Background Delivery & Back Buttons")
 
-# top controls: Pico connection
+# top controls: cart selection and Pico connection
 cols = st.columns([8, 1, 1])
+with cols[0]:
+    if len(CARTS) > 1:
+        st.selectbox("Cart", registry.ids(), key="cart_id", on_change=switch_cart)
 with cols[1]:
-    if st.session_state.pico_connected:
+    pico = get_pico()
+    if pico.running:
         if st.button("Disconnect Pico"):
-            try:
-                if st.session_state.pico and st.session_state.pico.is_open:
-                    st.session_state.pico.close()
-            except Exception:
-                pass
-            st.session_state.pico = None
-            st.session_state.pico_connected = False
+            pico.stop()
             st.success("Pico disconnected.")
     else:
         if st.button("Connect Pico"):
-            pico = get_pico()
-            if st.session_state.pico_connected:
-                st.success("Pico connected.")
-            else:
-                st.error("Could not connect to Pico. Check COM port and firmware.")
+            pico.start()
+            st.info("Connecting to Pico — retrying in the background until it answers.")
 
 with cols[2]:
     st.write(" ")  # spacer
@@ -490,18 +331,54 @@ if not st.session_state.authenticated:
             reset_main()
         else:
             st.error("Incorrect passcode")
+    render.finish()
     st.stop()
 
+# ---------------- PANELS ----------------
+# Each panel reruns on its own timer instead of the whole page.
+@fragment(run_every=REFRESH_INTERVAL_SEC)
+def alerts_panel():
+    with metrics.trace("render", "alerts"):
+        show_log_health()
+        show_out_alerts_in_app()
+
+
+@fragment(run_every=REFRESH_INTERVAL_SEC)
+def cabinet_panel():
+    with metrics.trace("render", "cabinets"):
+        st.subheader("Cabinet Manual Control")
+        if not get_pico().connected:
+            st.warning("Pico not connected — cabinets cannot be controlled from here.")
+        cols = st.columns(NUM_SERVOS)
+        for i in range(NUM_SERVOS):
+            cab = i + 1
+            with cols[i]:
+                locked = get_cart().cabinet_locked.get(cab, True)
+                st.write(f"Cabinet {cab}")
+                st.write(f"Status: {'Locked' if locked else 'Unlocked'}")
+                if st.button(f"Unlock {cab}", key=f"manual_unlock_{cab}"):
+                    unlock_cabinet(cab)
+                if st.button(f"Lock {cab}", key=f"manual_lock_{cab}"):
+                    lock_cabinet(cab)
+
+
+@fragment(run_every=INVENTORY_REFRESH_SEC)
+def inventory_panel():
+    with metrics.trace("render", "inventory"):
+        st.subheader("Inventory")
+        inventory = get_cart().inventory_view()
+        if inventory.empty:
+            st.info("No inventory. Add items or upload template.")
+        else:
+            show_paged(inventory, key="inventory_page")
+
+
 # periodic checks
-check_and_relock_expired()
-show_out_alerts_in_app()
+alerts_panel()
 
 # patient list visible
 with st.expander("🧾 Patient List (always visible)", expanded=True):
-    rows = []
-    for pid, info in st.session_state.patients.items():
-        rows.append({"Patient ID": pid, "Name": info.get("Name", pid), "Drugs": ", ".join(info.get("Drugs", []))})
-    show_dataframe(pd.DataFrame(rows))
+    show_paged(get_cart().patient_view(), key="patients_page")
 
 # CSV / Template in expander
 with st.expander("📁 Upload / Download Templates"):
@@ -527,6 +404,21 @@ with st.expander("📁 Upload / Download Templates"):
             st.download_button("Download Patients_Template.xlsx", data=b2, file_name="Patients_Template.xlsx",
                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
+# Audit export from the durable log
+with st.expander("🔎 Audit Log Export"):
+    a1, a2 = st.columns(2)
+    with a1:
+        audit_from = st.date_input("From", value=date.today() - timedelta(days=7), key="audit_from")
+    with a2:
+        audit_to = st.date_input("To (inclusive)", value=date.today(), key="audit_to")
+    if st.button("Build Audit Export"):
+        start = datetime.combine(audit_from, dtime.min).timestamp()
+        end = datetime.combine(audit_to + timedelta(days=1), dtime.min).timestamp()
+        events = get_cart().audit_events(start, end)
+        st.write(f"{len(events)} events")
+        st.download_button("Download audit CSV", data=events.to_csv(index=False).encode(),
+                           file_name=f"audit_{audit_from}_{audit_to}.csv", mime="text/csv")
+
 st.divider()
 
 # Main menu
@@ -569,34 +461,14 @@ if st.session_state.menu == "add_new":
     with st.form("form_add_new", clear_on_submit=True):
         drug = st.text_input("Drug Name")
         barcode = st.text_input("Barcode (scan or type)")
-        amount = st.number_input("Amount", min_value=1, value=1)
+        amount = st.number_input("Amount", min_value=1, max_value=MAX_COUNT, value=1)
         needs_waste = st.checkbox("Needs Waste after use?")
         cabinet = st.number_input(f"Cabinet (1–{NUM_SERVOS})", min_value=1, max_value=NUM_SERVOS, value=1)
-        section = st.number_input("Section", min_value=1, value=1)
+        section = st.number_input("Section", min_value=1, max_value=MAX_SECTION, value=1)
         submitted = st.form_submit_button("Submit")
         if submitted:
-            df = st.session_state.df.copy()
-            if barcode in df["Barcode"].values:
-                idx = df.index[df["Barcode"] == barcode][0]
-                df.loc[idx, "Amount"] = int(df.loc[idx, "Amount"]) + int(amount)
-                st.session_state.df = df
-                try:
-                    unlock_cabinet(int(df.loc[idx, "Cabinet"]))
-                except Exception:
-                    pass
-                reset_main()
-            else:
-                new_row = {
-                    "Drug": drug, "Amount": int(amount), "Barcode": barcode,
-                    "Actively Out": 0, "Wasted": 0, "Delivered": 0,
-                    "Needs Waste": bool(needs_waste), "Cabinet": int(cabinet), "Section": int(section),
-                    "Last Dispensed Time": None, "Assigned Patient": None
-                }
-                st.session_state.df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-                try:
-                    unlock_cabinet(int(cabinet))
-                except Exception:
-                    pass
+            if show_result(get_cart().add_new(drug, barcode, int(amount), bool(needs_waste), int(cabinet),
+                                              int(section))):
                 reset_main()
 
 # Add Existing
@@ -663,28 +535,10 @@ if st.session_state.menu is None:
 
 # Manual cabinet controls
 st.markdown("---")
-st.subheader("Cabinet Manual Control")
-if not st.session_state.pico_connected:
-    st.warning("Pico not connected — cabinets cannot be controlled from here.")
-cols = st.columns(NUM_SERVOS)
-for i in range(NUM_SERVOS):
-    cab = i + 1
-    with cols[i]:
-        locked = st.session_state.cabinet_locked.get(cab, True)
-        st.write(f"Cabinet {cab}")
-        st.write(f"Status: {'Locked' if locked else 'Unlocked'}")
-        if st.button(f"Unlock {cab}", key=f"manual_unlock_{cab}"):
-            unlock_cabinet(cab)
-        if st.button(f"Lock {cab}", key=f"manual_lock_{cab}"):
-            lock_cabinet(cab)
-
-# Inventory display & final checks
+cabinet_panel()
+
+# Inventory display
 st.markdown("---")
-st.subheader("Inventory")
-if st.session_state.df.empty:
-    st.info("No inventory. Add items or upload template.")
-else:
-    show_dataframe(st.session_state.df)
-
-check_and_relock_expired()
-show_out_alerts_in_app()
+inventory_panel()
+
+render.finish()
@@ -0,0 +1,61 @@
+# bench_inventory.py — Per-scan latency of InventoryStore vs the old DataFrame scan
+# Run: python bench_inventory.py
+import random
+import time
+
+from inventory import COLUMNS, InventoryStore
+
+SIZES = [100, 1_000, 10_000, 100_000]
+SCANS = 2_000
+
+
+def build_store(n):
+    inv = InventoryStore()
+    for i in range(n):
+        inv.insert(f"Drug{i}", f"B{i:06d}", amount=1_000_000, needs_waste=i % 2 == 0, cabinet=i % 5 + 1)
+    return inv
+
+
+def dataframe_dispense(df, s):
+    # the lookup + per-field writes handle_cart_scan used to do
+    if s in df["Barcode"].values:
+        idx = df.index[df["Barcode"] == s][0]
+        if int(df.loc[idx, "Amount"]) > 0:
+            df.loc[idx, "Amount"] = int(df.loc[idx, "Amount"]) - 1
+            df.loc[idx, "Actively Out"] = int(df.loc[idx, "Actively Out"]) + 1
+            df.loc[idx, "Last Dispensed Time"] = "2024-01-01 00:00:00"
+        return int(df.loc[idx, "Cabinet"])
+    return None
+
+
+def store_dispense(inv, s):
+    row = inv.find(s)
+    if row is not None:
+        inv.dispense(row, "2024-01-01 00:00:00")
+        return inv.cabinet(row)
+    return None
+
+
+def per_scan_us(fn, target, scans):
+    t0 = time.perf_counter()
+    for s in scans:
+        fn(target, s)
+    return (time.perf_counter() - t0) / len(scans) * 1e6
+
+
+def main():
+    print(f"{'rows':>8} {'store us/scan':>14} {'dataframe us/scan':>18}")
+    for n in SIZES:
+        inv = build_store(n)
+        scans = [f"B{random.randrange(n):06d}" for _ in range(SCANS)]
+        store_us = per_scan_us(store_dispense, inv, scans)
+
+        df = inv.to_dataframe().astype({"Last Dispensed Time": object})
+        assert list(df.columns) == COLUMNS
+        df_scans = scans[: max(20, SCANS // (n // 100))]
+        df_us = per_scan_us(dataframe_dispense, df, df_scans)
+        print(f"{n:>8} {store_us:>14.2f} {df_us:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# bench_render.py — CPU time of the data work done per refresh of the cart pages
+# Run: python bench_render.py
+#
+# Times the real Cart views the page reads on every refresh (overdue_alerts,
+# patient_view, inventory_view and the PAGE_ROWS slice that gets shown), not
+# Streamlit's own serialization. "idle" refreshes are served from the view
+# cache; "after mutation" refreshes follow one scan, so the views rebuild.
+# "before" is the work every rerun of the old single-script page did on the
+# same data: the alert and relock scans twice, the patient frame built row by
+# row and the full inventory frame.
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from carts import PAGE_ROWS, TIME_FMT, CartRegistry
+
+SIZES = [1_000, 10_000, 100_000]
+PATIENTS = 2_000
+REFRESHES = 20
+
+
+def build(registry, n):
+    cart = registry.get(f"render{n}")
+    cart.import_inventory([pd.DataFrame({
+        "Drug": [f"Drug{i}" for i in range(n)],
+        "Barcode": [f"B{i:06d}" for i in range(n)],
+        "Needs_Waste": ["False"] * n,
+        "Cabinet": [str(i % 5 + 1) for i in range(n)],
+        "Amount": ["10"] * n,
+    })], "stock.csv")
+    cart.import_patients([pd.DataFrame({
+        "Patient": [f"P{i // 2}" for i in range(2 * PATIENTS)],
+        "Drug": [f"Drug{(i // 2 + i % 2) % n}" for i in range(2 * PATIENTS)],
+    })], "patients.csv")
+    for i in range(0, n, 10):
+        cart.scan(f"B{i:06d}", "dispense")
+    return cart
+
+
+def refresh(cart):
+    # what one rerun of the alerts fragment and both table pages reads
+    cart.overdue_alerts()
+    cart.patient_view().iloc[:PAGE_ROWS]
+    cart.inventory_view().iloc[:PAGE_ROWS]
+
+
+def old_session_state(cart):
+    """The dicts the old page kept in session state, filled from the cart's data."""
+    now = datetime.now()
+    last_dispensed = {drug: datetime.strptime(ts, TIME_FMT) - timedelta(minutes=i % 10)
+                      for i, (_, drug, ts) in enumerate(cart.inventory.dispensed_times())}
+    unlock_expiries = {c: now + timedelta(seconds=cart.auto_relock_seconds) for c in range(1, cart.num_cabinets + 1)}
+    return last_dispensed, unlock_expiries
+
+
+def old_alert_scans(cart, last_dispensed, unlock_expiries):
+    # show_out_alerts_in_app + check_and_relock_expired, minus the Streamlit calls
+    now = datetime.now()
+    warning = timedelta(seconds=cart.out_warning_seconds)
+    messages = [f"🚨 **{drug}** — out for {int((now - ts).total_seconds() // 60)} minutes"
+                for drug, ts in last_dispensed.items() if ts and now - ts > warning]
+    expired = [c for c, exp in unlock_expiries.items() if exp is not None and now >= exp]
+    return messages, expired
+
+
+def refresh_before(cart, last_dispensed, unlock_expiries):
+    # whole-page rerun: alerts twice, patient rows one by one, full inventory frame
+    old_alert_scans(cart, last_dispensed, unlock_expiries)
+    rows = []
+    for pid, info in cart.patients.items():
+        rows.append({"Patient ID": pid, "Name": info.get("Name", pid), "Drugs": ", ".join(info.get("Drugs", []))})
+    pd.DataFrame(rows)
+    cart.inventory.to_dataframe()
+    old_alert_scans(cart, last_dispensed, unlock_expiries)
+
+
+def cpu_ms(fn, *args, mutate=None):
+    fn(*args)   # warm-up: fills the view cache
+    total = 0.0
+    for i in range(REFRESHES):
+        if mutate is not None:
+            mutate.scan(f"B{i:06d}", "add_existing")
+        t0 = time.process_time()
+        fn(*args)
+        total += time.process_time() - t0
+    return total / REFRESHES * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as workdir:
+        registry = CartRegistry(
+            {f"render{n}": "loop://" for n in SIZES}, baudrate=115200, num_cabinets=5, auto_relock_seconds=20,
+            out_warning_minutes=5, log_path=os.path.join(workdir, "{cart}.sqlite3"), default_patients={},
+        )
+        print(f"{'rows':>8} {'before ms/refresh':>18} {'idle ms/refresh':>16} {'after mutation ms/refresh':>26}")
+        for n in SIZES:
+            cart = build(registry, n)
+            before = cpu_ms(refresh_before, cart, *old_session_state(cart))
+            idle = cpu_ms(refresh, cart)
+            mutated = cpu_ms(refresh, cart, mutate=cart)
+            print(f"{n:>8} {before:>18.2f} {idle:>16.3f} {mutated:>26.2f}")
+            cart.txlog.close()
+        registry.timers.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# bench_servo.py — Run the servo.py firmware on a pty with a stub `machine` module and time unlocks
+# Run: python bench_servo.py [cabinets]   (Linux/macOS)
+# Sends UNLOCK1..N at once; the non-blocking firmware should finish them all in about one MOVE_MS.
+import os
+import pty
+import select
+import subprocess
+import sys
+import time
+import tty
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIRMWARE = os.path.join(HERE, "..", "servo.py")
+STUB_DIR = os.path.join(HERE, "firmware_stub")
+TIMEOUT_SEC = 10
+
+
+def read_lines(fd, buf):
+    data = os.read(fd, 4096)
+    *lines, rest = (buf + data).split(b"\n")
+    return [line.decode(errors="replace").strip() for line in lines], rest
+
+
+def run(cabinets):
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    env = dict(os.environ, PYTHONPATH=STUB_DIR)
+    proc = subprocess.Popen([sys.executable, "-u", FIRMWARE], stdin=slave, stdout=slave, env=env)
+    os.close(slave)
+    try:
+        time.sleep(0.5)     # let the firmware start and reach its loop
+        t0 = time.monotonic()
+        os.write(master, "".join(f"UNLOCK{i}\n" for i in range(1, cabinets + 1)).encode())
+        done, buf, replies = {}, b"", []
+        while len(done) < cabinets and time.monotonic() - t0 < TIMEOUT_SEC:
+            if not select.select([master], [], [], 0.1)[0]:
+                continue
+            lines, buf = read_lines(master, buf)
+            for line in lines:
+                replies.append(line)
+                if line.startswith("Unlocked cabinet"):
+                    done[line] = time.monotonic() - t0
+        return done, replies
+    finally:
+        proc.terminate()
+        proc.wait(timeout=5)
+        os.close(master)
+
+
+def main():
+    cabinets = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    done, replies = run(cabinets)
+    if len(done) < cabinets:
+        print(f"only {len(done)} of {cabinets} unlocks completed; firmware said:")
+        print("\n".join(replies))
+        sys.exit(1)
+    print(f"{cabinets} unlocks completed in {max(done.values()):.3f} s "
+          f"(a blocking firmware would need about {cabinets} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+# carts.py — Process-wide cart registry shared by every browser session
+import copy
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+import metrics
+from importer import (INVENTORY_REQUIRED, PATIENTS_REQUIRED, ImportReport, check_columns, merge_patients,
+                      normalize_inventory, reject_lines)
+from inventory import MAX_COUNT, MAX_SECTION
+from pico_link import get_link
+from timers import TimerService
+from txlog import TxLog
+
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
+PAGE_ROWS = 200     # rows per page when a view is shown in pages
+
+
+class Cart:
+    """One physical cart: inventory, patients, cabinets and its Pico link.
+
+    Sessions attach to a cart instead of owning the state. Every
+    read-modify-write runs under ``self.lock``, so all sessions on the cart
+    see one consistent order of events. Carts have separate locks, so scans
+    on different carts do not wait for each other.
+
+    Scan methods return None on success, or ``(level, message)`` for the UI
+    where level is "error", "warning" or "info". Each scan is traced (see
+    metrics.py) under a correlation ID that follows its Pico command.
+    """
+
+    def __init__(self, cart_id, port, timers, baudrate, num_cabinets, auto_relock_seconds,
+                 out_warning_minutes, log_path, default_patients):
+        self.cart_id = cart_id
+        self.port = port
+        self.num_cabinets = num_cabinets
+        self.auto_relock_seconds = auto_relock_seconds
+        self.out_warning_seconds = out_warning_minutes * 60
+        self.lock = threading.RLock()
+        self.txlog = TxLog(log_path.format(cart=cart_id))
+        self.inventory, self.patients = self.txlog.recover(copy.deepcopy(default_patients))
+        self.link = get_link(port, baudrate, num_cabinets)
+        self.cabinet_locked = self.link.cabinet_locked
+        self.overdue = {}   # barcode -> (drug, dispensed at in epoch seconds)
+        self._timers = timers
+        self._views = {}    # name -> (version, DataFrame)
+
+    @property
+    def version(self):
+        """Bumped by every recorded mutation."""
+        return self.txlog.version
+
+    def _record(self, kind, **payload):
+        self.txlog.append(kind, **payload)
+        if self.txlog.snapshot_due():
+            self.txlog.snapshot(self.inventory, self.patients)
+
+    # ---------------- CABINETS ----------------
+    def unlock_cabinet(self, n):
+        if not (1 <= n <= self.num_cabinets):
+            return False
+        ok = self.link.send(f"UNLOCK{n}")
+        if ok:
+            self.cabinet_locked[n] = False
+            self._timers.schedule((self.cart_id, "relock", n), time.time() + self.auto_relock_seconds)
+        return ok
+
+    def lock_cabinet(self, n):
+        if not (1 <= n <= self.num_cabinets):
+            return False
+        ok = self.link.send(f"LOCK{n}")
+        if ok:
+            self.cabinet_locked[n] = True
+            self._timers.cancel((self.cart_id, "relock", n))
+        return ok
+
+    def unlock_all(self):
+        cabs = range(1, self.num_cabinets + 1)
+        ok = self.link.send(*(f"UNLOCK{i}" for i in cabs))
+        if ok:
+            expiry = time.time() + self.auto_relock_seconds
+            for i in cabs:
+                self.cabinet_locked[i] = False
+                self._timers.schedule((self.cart_id, "relock", i), expiry)
+        return ok
+
+    # ---------------- TIMERS / ALERTS ----------------
+    def on_timer(self, kind, ident, data):
+        with metrics.trace("timer", kind), self.lock:
+            if kind == "relock":
+                if not self.cabinet_locked.get(ident, True) and self.link.send(f"LOCK{ident}"):
+                    self.cabinet_locked[ident] = True
+            elif kind == "out":
+                # skip a timer that fired while its item was being returned
+                row = self.inventory.find(ident)
+                if row is not None and self.inventory.last_dispensed(row) is not None:
+                    self.overdue[ident] = data
+
+    def resume_timers(self):
+        """Re-arm overdue timers for units still out after recovery."""
+        with self.lock:
+            for barcode, drug, ts in self.inventory.dispensed_times():
+                self._mark_dispensed(barcode, drug, datetime.strptime(ts, TIME_FMT).timestamp())
+
+    def _mark_dispensed(self, barcode, drug, since):
+        """(Re)start the out-too-long timer for a barcode; latest dispense wins."""
+        self.overdue.pop(barcode, None)
+        self._timers.schedule((self.cart_id, "out", barcode), since + self.out_warning_seconds, (drug, since))
+
+    def _clear_dispensed(self, barcode):
+        self._timers.cancel((self.cart_id, "out", barcode))
+        self.overdue.pop(barcode, None)
+
+    def overdue_alerts(self):
+        with self.lock:
+            return list(self.overdue.values())
+
+    # ---------------- SCANS ----------------
+    def _dispense(self, s, row):
+        now = datetime.now()
+        when = now.strftime(TIME_FMT)
+        if not self.inventory.dispense(row, when):
+            return False
+        drug = self.inventory.drug(row)
+        self._record("dispense", barcode=s, drug=drug, when=when)
+        self._mark_dispensed(s, drug, now.timestamp())
+        self.unlock_cabinet(self.inventory.cabinet(row))
+        return True
+
+    def scan(self, s, context=None):
+        """Cart-scanner scan in one of the add_existing / dispense / return / waste
+        contexts, or a quick dispense when ``context`` is None."""
+        label = context or "quick"
+        with metrics.trace("scan", self.cart_id, label):
+            result = self._scan(s, context)
+        if result is not None:
+            metrics.inc("cartos_scan_rejects_total", self.cart_id, label, result[0])
+        return result
+
+    def _scan(self, s, context):
+        with self.lock:
+            inv = self.inventory
+            row = inv.find(s)
+
+            if context == "add_existing":
+                if row is None:
+                    return "error", "Barcode not found; consider Add New."
+                inv.add_units(row, 1)
+                self._record("add_units", barcode=s, drug=inv.drug(row), n=1)
+                self.unlock_cabinet(inv.cabinet(row))
+                return None
+
+            if context == "dispense":
+                if row is None:
+                    return "error", "Barcode not found."
+                if not self._dispense(s, row):
+                    return "warning", "No stock available to dispense."
+                return None
+
+            if context == "return":
+                if row is None:
+                    return "error", "Barcode not found."
+                if not inv.return_unit(row):
+                    return "warning", "No actively out units to return."
+                self._record("return", barcode=s, drug=inv.drug(row))
+                self._clear_dispensed(s)
+                self.lock_cabinet(inv.cabinet(row))
+                return None
+
+            if context == "waste":
+                if row is None:
+                    return "error", "Barcode not found."
+                if not inv.waste(row):
+                    return "info", "Nothing to waste or waste not required."
+                self._record("waste", barcode=s, drug=inv.drug(row))
+                if inv.actively_out(row) == 0:
+                    self._clear_dispensed(s)
+                return None
+
+            # generic quick dispense
+            if row is None:
+                return "error", "Barcode not found in inventory."
+            if not self._dispense(s, row):
+                return "warning", "No stock to dispense."
+            return None
+
+    def has_patient(self, patient_id):
+        with self.lock:
+            return patient_id in self.patients
+
+    def deliver(self, patient_id, code):
+        """Delivery-scanner drug scan for ``patient_id``. Silent on success."""
+        with metrics.trace("scan", self.cart_id, "delivery"):
+            result = self._deliver(patient_id, code)
+        if result is not None:
+            metrics.inc("cartos_scan_rejects_total", self.cart_id, "delivery", result[0])
+        return result
+
+    def _deliver(self, patient_id, code):
+        with self.lock:
+            row = self.inventory.find(code)
+            if row is None:
+                return "warning", "Delivery scan: drug barcode not found."
+            drug_name = self.inventory.drug(row)
+            if drug_name not in self.patients.get(patient_id, {}).get("Drugs", []):
+                return "warning", f"Delivery warning: {drug_name} not prescribed for {patient_id}"
+            self.inventory.deliver(row, patient_id)
+            self._record("deliver", barcode=code, drug=drug_name, patient=patient_id)
+            self._clear_dispensed(code)
+            return None
+
+    def add_new(self, drug, barcode, amount, needs_waste, cabinet, section):
+        """Add New form: top up an existing barcode or insert a new drug.
+
+        Returns None on success or ``(level, message)`` like the scans.
+        """
+        if not (1 <= cabinet <= self.num_cabinets) or not (1 <= section <= MAX_SECTION):
+            return "error", f"Cabinet must be 1–{self.num_cabinets} and Section 1–{MAX_SECTION}."
+        if not (0 <= amount <= MAX_COUNT):
+            return "error", f"Amount must be 0–{MAX_COUNT}."
+        with self.lock:
+            inv = self.inventory
+            row = inv.find(barcode)
+            if row is not None and inv.amount(row) + amount > MAX_COUNT:
+                return "error", f"{inv.drug(row)} already has {inv.amount(row)}; the stock cannot exceed {MAX_COUNT}."
+            if row is not None:
+                inv.add_units(row, amount)
+                self._record("add_units", barcode=barcode, drug=inv.drug(row), n=amount)
+                self.unlock_cabinet(inv.cabinet(row))
+            else:
+                inv.insert(drug, barcode, amount, needs_waste, cabinet, section)
+                self._record("insert", drug=drug, barcode=barcode, amount=amount, needs_waste=needs_waste,
+                             cabinet=cabinet, section=section)
+                self.unlock_cabinet(cabinet)
+        return None
+
+    # ---------------- IMPORTS ----------------
+    def import_inventory(self, chunks, name):
+        """Merge raw upload chunks; the lock is held per chunk, not per file.
+
+        The whole upload is read and validated first, so a file that fails
+        to parse part-way changes nothing.
+        """
+        report = ImportReport()
+        cleaned = []
+        for i, chunk in enumerate(chunks):
+            if i == 0:
+                check_columns(chunk, INVENTORY_REQUIRED, "Inventory")
+            cleaned.append(normalize_inventory(chunk, report, self.num_cabinets))
+        for clean in cleaned:
+            with self.lock, metrics.span("inventory", "merge"):
+                merged, inserted, new_rows, overflow = self.inventory.merge_frame(clean)
+                self._record("merge", file=name, columns=list(clean.columns),
+                             rows=clean.astype(object).values.tolist())
+            reject_lines(clean, overflow, f"Amount would take the stock above {MAX_COUNT}", report)
+            report.merged += merged
+            report.inserted += inserted
+            report.new_rows += new_rows
+        return report
+
+    def import_patients(self, chunks, name):
+        """Merge Patient→Drug chunks, after reading the whole upload (see import_inventory)."""
+        report = ImportReport()
+        read = []
+        for i, chunk in enumerate(chunks):
+            if i == 0:
+                check_columns(chunk, PATIENTS_REQUIRED, "Patient")
+            read.append(chunk)
+        for chunk in read:
+            pairs = chunk[["Patient", "Drug"]].astype(object).where(chunk[["Patient", "Drug"]].notna(), None)
+            with self.lock:
+                merge_patients(self.patients, chunk, report)
+                self._record("patients", file=name, rows=pairs.values.tolist())
+        return report
+
+    # ---------------- VIEWS ----------------
+    def _view(self, name, build):
+        with self.lock:
+            cached = self._views.get(name)
+            if cached is None or cached[0] != self.version:
+                cached = self._views[name] = (self.version, build())
+            return cached[1]
+
+    def inventory_view(self):
+        """Inventory DataFrame, rebuilt only after a mutation; shared by all sessions."""
+        return self._view("inventory", self.inventory.to_dataframe)
+
+    def patient_view(self):
+        return self._view("patients", lambda: pd.DataFrame({
+            "Patient ID": list(self.patients),
+            "Name": [info.get("Name", pid) for pid, info in self.patients.items()],
+            "Drugs": [", ".join(info.get("Drugs", [])) for info in self.patients.values()],
+        }))
+
+    def audit_events(self, start, end):
+        return self.txlog.events_between(start, end)
+
+
+class CartRegistry:
+    """All carts served by this process, created on first attach.
+
+    ``ports`` maps cart id to the Pico serial port; every other keyword is
+    passed to each ``Cart``. One TimerService serves all carts; timer keys
+    start with the cart id so fired timers go back to their cart.
+    """
+
+    def __init__(self, ports, **cart_settings):
+        self.ports = dict(ports)
+        self._cart_settings = cart_settings
+        self._carts = {}
+        self._lock = threading.Lock()
+        self.timers = TimerService()
+        self.timers.subscribe(self._on_timer)
+        self.timers.start()
+        metrics.gauge("cartos_timers_pending", lambda: len(self.timers))
+
+    def ids(self):
+        return list(self.ports)
+
+    def get(self, cart_id):
+        with self._lock:
+            cart = self._carts.get(cart_id)
+            if cart is None:
+                cart = Cart(cart_id, self.ports[cart_id], self.timers, **self._cart_settings)
+                self._carts[cart_id] = cart
+                cart.resume_timers()
+            return cart
+
+    def _on_timer(self, key, data):
+        cart_id, kind, ident = key
+        cart = self._carts.get(cart_id)
+        if cart is not None:
+            cart.on_timer(kind, ident, data)
@@ -0,0 +1,30 @@
+# machine.py — Desktop stand-in for MicroPython's `machine` module, for running servo.py off the Pico
+# Used by bench_servo.py: PYTHONPATH=firmware_stub python ../servo.py
+
+
+class Pin:
+    OUT = 1
+    IN = 0
+
+    def __init__(self, pin_id, mode=None):
+        self.pin_id = pin_id
+        self.value = 0
+
+    def on(self):
+        self.value = 1
+
+    def off(self):
+        self.value = 0
+
+
+class PWM:
+    def __init__(self, pin):
+        self.pin = pin
+        self.duty = None
+        self.frequency = None
+
+    def freq(self, hz):
+        self.frequency = hz
+
+    def duty_u16(self, duty):
+        self.duty = duty
@@ -0,0 +1,152 @@
+# importer.py — Chunked, vectorized inventory / patient file imports
+import pandas as pd
+
+from inventory import MAX_COUNT, MAX_SECTION
+
+CHUNK_ROWS = 20_000
+
+INVENTORY_REQUIRED = {"Drug", "Barcode", "Needs_Waste", "Cabinet", "Amount"}
+PATIENTS_REQUIRED = {"Patient", "Drug"}
+
+# read identifiers as text so "00123" stays "00123" instead of 123.0
+TEXT_COLUMNS = {"Drug": str, "Barcode": str, "Patient": str}
+
+TRUE_STRINGS = {"true", "t", "yes", "y", "1", "1.0"}
+FALSE_STRINGS = {"false", "f", "no", "n", "0", "0.0", ""}
+
+
+class MissingColumnsError(ValueError):
+    """The uploaded file lacks required columns."""
+
+
+def check_columns(frame, required, what):
+    if not required.issubset(set(frame.columns)):
+        raise MissingColumnsError(f"{what} file must contain columns: {', '.join(sorted(required))}")
+
+
+class ImportReport:
+    """Running totals for one uploaded file, summed across chunks."""
+
+    def __init__(self):
+        self.merged = 0
+        self.inserted = 0
+        self.new_rows = 0
+        self.rejected = []   # DataFrames of rejected lines with a "Reason" column
+
+    @property
+    def rejected_count(self):
+        return sum(len(r) for r in self.rejected)
+
+    def rejected_frame(self):
+        if not self.rejected:
+            return pd.DataFrame(columns=["Line", "Reason"])
+        return pd.concat(self.rejected, ignore_index=True)
+
+    def summary(self):
+        return (f"{self.merged} merged, {self.inserted} inserted "
+                f"({self.new_rows} new), {self.rejected_count} rejected")
+
+
+def read_table_chunks(uploaded):
+    """Yield the upload as DataFrames; CSVs stream in CHUNK_ROWS pieces."""
+    if uploaded.name.lower().endswith(".xlsx"):
+        yield pd.read_excel(uploaded, dtype=TEXT_COLUMNS)
+    else:
+        yield from pd.read_csv(uploaded, dtype=TEXT_COLUMNS, chunksize=CHUNK_ROWS)
+
+
+def _text(col):
+    return col.astype("string").str.strip()
+
+
+def _parse_bool(col):
+    text = col.astype("string").str.strip().str.lower().fillna("")
+    out = pd.Series(pd.NA, index=col.index, dtype="boolean")
+    out[text.isin(TRUE_STRINGS)] = True
+    out[text.isin(FALSE_STRINGS)] = False
+    return out
+
+
+def _reject(frame, mask, reason, report):
+    if mask.any():
+        bad = frame[mask].copy()
+        bad.insert(0, "Line", bad.index + 2)   # +1 header, +1 one-based
+        bad["Reason"] = reason
+        report.rejected.append(bad)
+
+
+def reject_lines(frame, index, reason, report):
+    """Report the lines of ``frame`` at ``index`` as rejected (e.g. refused by the store)."""
+    _reject(frame, frame.index.isin(index), reason, report)
+
+
+def _not_whole(col):
+    return col.notna() & (col % 1 != 0)
+
+
+def normalize_inventory(raw, report, num_cabinets=None):
+    """Type-check an inventory chunk; bad lines go to ``report.rejected``.
+
+    Cabinets must be 1..``num_cabinets`` (unchecked when None); numbers
+    that would not fit the store's counter columns are rejected, never
+    wrapped or truncated.
+    """
+    drug = _text(raw["Drug"])
+    barcode = _text(raw["Barcode"])
+    needs_waste = _parse_bool(raw["Needs_Waste"])
+    cabinet = pd.to_numeric(raw["Cabinet"], errors="coerce")
+    raw_section = raw["Section"] if "Section" in raw else pd.Series(1, index=raw.index)
+    section = pd.to_numeric(raw_section, errors="coerce")
+    amount = pd.to_numeric(raw["Amount"], errors="coerce")
+    max_cabinet = MAX_SECTION if num_cabinets is None else num_cabinets
+
+    checks = [
+        (drug.isna() | (drug == ""), "missing Drug"),
+        (barcode.isna() | (barcode == ""), "missing Barcode"),
+        (needs_waste.isna(), "Needs_Waste is not true/false"),
+        (raw["Cabinet"].notna() & cabinet.isna(), "Cabinet is not a number"),
+        (_not_whole(cabinet) | (cabinet < 1) | (cabinet > max_cabinet),
+         f"Cabinet is not a whole number from 1 to {max_cabinet}"),
+        (raw_section.notna() & section.isna(), "Section is not a number"),
+        (_not_whole(section) | (section < 1) | (section > MAX_SECTION),
+         f"Section is not a whole number from 1 to {MAX_SECTION}"),
+        (raw["Amount"].notna() & amount.isna(), "Amount is not a number"),
+        (_not_whole(amount), "Amount is not a whole number"),
+        (amount < 0, "negative Amount"),
+        (amount > MAX_COUNT, f"Amount is larger than {MAX_COUNT}"),
+    ]
+    bad = pd.Series(False, index=raw.index)
+    for mask, reason in checks:
+        mask = mask.fillna(False).astype(bool) & ~bad
+        _reject(raw, mask, reason, report)
+        bad |= mask
+
+    ok = ~bad
+    return pd.DataFrame({
+        "Drug": drug[ok].astype(object),
+        "Barcode": barcode[ok].astype(object),
+        "Needs_Waste": needs_waste[ok].astype(bool),
+        "Cabinet": cabinet[ok].fillna(1).astype(int),
+        "Section": section[ok].fillna(1).astype(int),
+        "Amount": amount[ok].fillna(0).astype(int),
+    })
+
+
+def merge_patients(patients, raw, report):
+    """Add Patient→Drug lines to the ``patients`` dict, grouped in one pass."""
+    pid = _text(raw["Patient"])
+    drug = _text(raw["Drug"])
+    missing = pid.isna() | (pid == "") | drug.isna() | (drug == "")
+    _reject(raw, missing.astype(bool), "missing Patient or Drug", report)
+
+    grouped = pd.DataFrame({"Patient": pid[~missing], "Drug": drug[~missing]}).groupby(
+        "Patient", sort=False)["Drug"].agg(list)
+    for p, drugs in grouped.items():
+        entry = patients.get(p)
+        if entry is None:
+            patients[p] = {"Name": p, "Drugs": list(dict.fromkeys(drugs))}
+            report.inserted += len(drugs)
+            report.new_rows += 1
+        else:
+            entry["Drugs"] = list(dict.fromkeys(entry["Drugs"] + drugs))
+            report.merged += len(drugs)
@@ -0,0 +1,329 @@
+# inventory.py — Hash-indexed inventory store used by StreamLitDE.py
+import numpy as np
+import pandas as pd
+
+COLUMNS = [
+    "Drug", "Amount", "Barcode", "Actively Out", "Wasted",
+    "Delivered", "Needs Waste", "Cabinet", "Section", "Last Dispensed Time", "Assigned Patient"
+]
+
+# counter columns, stored together in one int32 block
+AMOUNT, OUT, WASTED, DELIVERED = range(4)
+COUNTER_COLUMNS = ["Amount", "Actively Out", "Wasted", "Delivered"]
+MAX_COUNT = int(np.iinfo(np.int32).max)      # largest value a counter column can hold
+MAX_SECTION = int(np.iinfo(np.int16).max)
+
+INITIAL_CAPACITY = 64
+
+
+class InventoryStore:
+    """Inventory rows kept in typed columns with barcode and drug-name indexes.
+
+    Every lookup goes through ``find`` / ``find_drug`` (dict lookups), every
+    mutation touches one row in place, and the DataFrame is only built when
+    the UI asks for it via ``to_dataframe``.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self._n = 0
+        self._counts = np.zeros((capacity, len(COUNTER_COLUMNS)), dtype=np.int32)
+        self._cabinet = np.ones(capacity, dtype=np.int16)
+        self._section = np.ones(capacity, dtype=np.int16)
+        self._needs_waste = np.zeros(capacity, dtype=bool)
+        self._drug = []
+        self._barcode = []
+        self._last_dispensed = []
+        self._patient = []
+        self._by_barcode = {}
+        self._by_drug = {}
+
+    def __len__(self):
+        return self._n
+
+    # ---------------- LOOKUPS ----------------
+    def find(self, barcode):
+        """Row for ``barcode`` or None."""
+        return self._by_barcode.get(barcode)
+
+    def find_drug(self, drug):
+        """First row holding ``drug`` or None."""
+        return self._by_drug.get(drug)
+
+    def drug(self, row):
+        return self._drug[row]
+
+    def barcode(self, row):
+        return self._barcode[row]
+
+    def cabinet(self, row):
+        return int(self._cabinet[row])
+
+    def amount(self, row):
+        return int(self._counts[row, AMOUNT])
+
+    def actively_out(self, row):
+        return int(self._counts[row, OUT])
+
+    def needs_waste(self, row):
+        return bool(self._needs_waste[row])
+
+    def last_dispensed(self, row):
+        return self._last_dispensed[row]
+
+    # ---------------- INSERT / MERGE ----------------
+    def _grow(self, needed):
+        cap = self._counts.shape[0]
+        if needed <= cap:
+            return
+        new_cap = max(needed, cap * 2)
+        counts = np.zeros((new_cap, len(COUNTER_COLUMNS)), dtype=np.int32)
+        counts[:cap] = self._counts
+        self._counts = counts
+        for name, fill in (("_cabinet", 1), ("_section", 1), ("_needs_waste", False)):
+            old = getattr(self, name)
+            arr = np.full(new_cap, fill, dtype=old.dtype)
+            arr[:cap] = old
+            setattr(self, name, arr)
+
+    def _set_barcode(self, row, barcode):
+        old = self._barcode[row]
+        if old == barcode:
+            return
+        if self._by_barcode.get(old) == row:
+            del self._by_barcode[old]
+        self._barcode[row] = barcode
+        self._by_barcode.setdefault(barcode, row)
+
+    def insert(self, drug, barcode, amount=0, needs_waste=False, cabinet=1, section=1):
+        """Append a new drug row and index it. Returns the row."""
+        row = self._n
+        self._grow(row + 1)
+        self._counts[row] = (amount, 0, 0, 0)
+        self._needs_waste[row] = bool(needs_waste)
+        self._cabinet[row] = cabinet
+        self._section[row] = section
+        self._drug.append(drug)
+        self._barcode.append(barcode)
+        self._last_dispensed.append(None)
+        self._patient.append(None)
+        self._by_barcode.setdefault(barcode, row)
+        self._by_drug.setdefault(drug, row)
+        self._n += 1
+        return row
+
+    def upsert(self, drug, barcode, amount, needs_waste, cabinet, section):
+        """Merge one restock line: match by barcode, then by drug name, else insert.
+
+        Returns ``(row, inserted)``, or ``(None, False)`` without changing
+        anything when the line would push Amount past MAX_COUNT.
+        """
+        row = self.find(barcode)
+        rekey = row is None
+        if rekey:
+            row = self.find_drug(drug)
+            if row is None:
+                return self.insert(drug, barcode, amount, needs_waste, cabinet, section), True
+        if int(self._counts[row, AMOUNT]) + amount > MAX_COUNT:
+            return None, False
+        if rekey and barcode:
+            self._set_barcode(row, barcode)
+        self._counts[row, AMOUNT] += amount
+        self._needs_waste[row] = bool(needs_waste)
+        self._cabinet[row] = cabinet
+        self._section[row] = section
+        return row, False
+
+    def _append_block(self, drugs, barcodes, amounts, needs_waste, cabinets, sections):
+        """Append many new rows at once. Keys must not already be indexed."""
+        start, k = self._n, len(drugs)
+        end = start + k
+        self._grow(end)
+        self._counts[start:end] = 0
+        self._counts[start:end, AMOUNT] = amounts
+        self._needs_waste[start:end] = needs_waste
+        self._cabinet[start:end] = cabinets
+        self._section[start:end] = sections
+        self._drug.extend(drugs)
+        self._barcode.extend(barcodes)
+        self._last_dispensed.extend([None] * k)
+        self._patient.extend([None] * k)
+        self._by_barcode.update(zip(barcodes, range(start, end)))
+        self._by_drug.update(zip(drugs, range(start, end)))
+        self._n = end
+
+    def merge_frame(self, frame):
+        """Merge a normalized restock frame (see importer.normalize_inventory).
+
+        The result is what ``upsert`` gives line by line, in file order:
+        match by Barcode, then by Drug (moving the row to the line's
+        barcode), else start a new row. Only the key lookups run per line;
+        each row then gets its summed Amount and the Needs_Waste / Cabinet /
+        Section of its last line in one vectorized write. A line that would
+        push its row's Amount past MAX_COUNT is skipped as a whole.
+        Returns ``(merged_lines, inserted_lines, new_rows, overflow)`` where
+        ``overflow`` is the frame index of the skipped lines.
+        """
+        if frame.empty:
+            return 0, 0, 0, frame.index[:0]
+        start = self._n
+        by_barcode, by_drug = self._by_barcode, self._by_drug
+        line_rows = np.empty(len(frame), dtype=np.int64)   # row per line, -1 = overflow
+        keys = {}           # barcode -> row, or None once removed; applied after the pass
+        barcodes = {}       # row -> its barcode after the lines so far
+        new_drugs = {}      # drug -> new row
+        totals = {}         # row -> Amount after the lines so far
+        lines = zip(frame["Drug"].tolist(), frame["Barcode"].tolist(), frame["Amount"].tolist())
+        for i, (drug, barcode, amount) in enumerate(lines):
+            row = keys[barcode] if barcode in keys else by_barcode.get(barcode)
+            rekey = row is None
+            if rekey:
+                row = new_drugs.get(drug)
+                if row is None:
+                    row = by_drug.get(drug)
+                if row is None:
+                    row = new_drugs[drug] = start + len(new_drugs)
+                    keys[barcode] = row
+                    barcodes[row] = barcode
+                    totals[row] = amount
+                    line_rows[i] = row
+                    continue
+            total = totals.get(row)
+            total = (int(self._counts[row, AMOUNT]) if total is None else total) + amount
+            if total > MAX_COUNT:
+                line_rows[i] = -1
+                continue
+            totals[row] = total
+            line_rows[i] = row
+            if rekey and barcode:
+                old = barcodes.get(row, self._barcode[row] if row < start else None)
+                if old != barcode:
+                    if (keys[old] if old in keys else by_barcode.get(old)) == row:
+                        keys[old] = None
+                    barcodes[row] = barcode
+                    keys[barcode] = row
+
+        ok = line_rows >= 0
+        last = frame[ok].groupby(line_rows[ok], sort=False)[["Needs_Waste", "Cabinet", "Section"]].last()
+        old_rows = last.index[last.index < start].to_numpy()
+        if len(old_rows):
+            fields = last.loc[old_rows]
+            self._counts[old_rows, AMOUNT] = [totals[r] for r in old_rows]
+            self._needs_waste[old_rows] = fields["Needs_Waste"].to_numpy(bool)
+            self._cabinet[old_rows] = fields["Cabinet"].to_numpy()
+            self._section[old_rows] = fields["Section"].to_numpy()
+        if new_drugs:
+            rows = list(new_drugs.values())
+            fields = last.loc[rows]
+            self._append_block(
+                list(new_drugs), [barcodes[r] for r in rows], [totals[r] for r in rows],
+                fields["Needs_Waste"].to_numpy(bool), fields["Cabinet"].to_numpy(), fields["Section"].to_numpy(),
+            )
+        for row, barcode in barcodes.items():
+            self._barcode[row] = barcode
+        for barcode, row in keys.items():
+            if row is None:
+                by_barcode.pop(barcode, None)
+            else:
+                by_barcode[barcode] = row
+
+        inserted = int((line_rows >= start).sum())
+        overflow = frame.index[~ok]
+        return len(frame) - inserted - len(overflow), inserted, len(new_drugs), overflow
+
+    # ---------------- SCAN OPERATIONS ----------------
+    def add_units(self, row, n=1):
+        self._counts[row, AMOUNT] += n
+
+    def dispense(self, row, when):
+        """Move one unit from stock to actively out. False if out of stock."""
+        counts = self._counts[row]
+        if counts[AMOUNT] <= 0:
+            return False
+        counts[AMOUNT] -= 1
+        counts[OUT] += 1
+        self._last_dispensed[row] = when
+        return True
+
+    def return_unit(self, row):
+        """Move one actively-out unit back to stock. False if none out."""
+        counts = self._counts[row]
+        if counts[OUT] <= 0:
+            return False
+        counts[OUT] -= 1
+        counts[AMOUNT] += 1
+        self._last_dispensed[row] = None
+        return True
+
+    def waste(self, row):
+        """Waste one actively-out unit of a needs-waste drug. False if not allowed."""
+        counts = self._counts[row]
+        if counts[OUT] <= 0 or not self._needs_waste[row]:
+            return False
+        counts[OUT] -= 1
+        counts[WASTED] += 1
+        if counts[OUT] == 0:
+            self._last_dispensed[row] = None
+        return True
+
+    def deliver(self, row, patient_id):
+        counts = self._counts[row]
+        if counts[OUT] > 0:
+            counts[OUT] -= 1
+        counts[DELIVERED] += 1
+        self._last_dispensed[row] = None
+        self._patient[row] = patient_id
+
+    # ---------------- SNAPSHOT ----------------
+    def snapshot(self):
+        """Plain-Python copy of every row (JSON-safe), for txlog snapshots."""
+        n = self._n
+        return {
+            "drug": list(self._drug),
+            "barcode": list(self._barcode),
+            "counts": self._counts[:n].tolist(),
+            "needs_waste": self._needs_waste[:n].tolist(),
+            "cabinet": self._cabinet[:n].tolist(),
+            "section": self._section[:n].tolist(),
+            "last_dispensed": list(self._last_dispensed),
+            "patient": list(self._patient),
+        }
+
+    @classmethod
+    def from_snapshot(cls, snap):
+        n = len(snap["drug"])
+        inv = cls(capacity=max(n, INITIAL_CAPACITY))
+        inv._append_block(snap["drug"], snap["barcode"], 0, snap["needs_waste"],
+                          snap["cabinet"], snap["section"])
+        if n:
+            inv._counts[:n] = snap["counts"]
+        inv._last_dispensed = list(snap["last_dispensed"])
+        inv._patient = list(snap["patient"])
+        # first row wins for duplicate keys, as with insert()
+        inv._by_barcode = {}
+        inv._by_drug = {}
+        for row, (drug, barcode) in enumerate(zip(inv._drug, inv._barcode)):
+            inv._by_barcode.setdefault(barcode, row)
+            inv._by_drug.setdefault(drug, row)
+        return inv
+
+    def dispensed_times(self):
+        """``(barcode, drug, last dispensed time)`` for rows with units still out."""
+        return [(b, d, t) for b, d, t in zip(self._barcode, self._drug, self._last_dispensed) if t is not None]
+
+    # ---------------- DISPLAY ----------------
+    def to_dataframe(self):
+        n = self._n
+        counts = self._counts[:n]
+        return pd.DataFrame({
+            "Drug": self._drug,
+            "Amount": counts[:, AMOUNT],
+            "Barcode": self._barcode,
+            "Actively Out": counts[:, OUT],
+            "Wasted": counts[:, WASTED],
+            "Delivered": counts[:, DELIVERED],
+            "Needs Waste": self._needs_waste[:n],
+            "Cabinet": self._cabinet[:n],
+            "Section": self._section[:n],
+            "Last Dispensed Time": self._last_dispensed,
+            "Assigned Patient": self._patient,
+        }, columns=COLUMNS)
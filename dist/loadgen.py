@@ -0,0 +1,341 @@
+# loadgen.py — Headless scan-replay load generator and benchmark suite
+#
+# Drives the cart scan handlers (all cart-scanner contexts, plus delivery
+# patient→drug pairs) and the inventory import against a simulated Pico,
+# then writes the results as JSON so runs can be compared between versions.
+#
+#   python loadgen.py --out results.json                   # synthetic trace, simulated Pico
+#   python loadgen.py --trace scans.csv --rate 50          # replay a recorded trace at 50 scans/s
+#   python loadgen.py --pico loop:// --out r.json          # no Pico replies: throughput only
+#   python loadgen.py --pico /dev/ttyACM0                  # real Pico on a serial port
+#   python loadgen.py --no-metrics --out off.json          # tracing overhead: compare with a normal run
+#   python loadgen.py --metrics-file trace.log             # ...or with the trace file on as well
+#   python loadgen.py --compare old.json new.json
+#
+# Trace CSV columns: kind (cart|delivery), context (add_existing|dispense|
+# return|waste, blank for quick dispense; blank for delivery), code.
+import argparse
+import csv
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+
+import metrics
+from carts import CartRegistry
+from importer import ImportReport, normalize_inventory, read_table_chunks
+from inventory import InventoryStore
+from pico_link import REPLY_ACK, REPLY_DONE
+from sim_pico import SimPico
+
+CONTEXTS = ["dispense", "dispense", None, "return", "waste", "add_existing"]
+UNLOCKING = {None, "dispense", "add_existing"}
+IMPORT_SIZES = [1_000, 10_000, 50_000]
+MEMORY_SIZES = [1_000, 10_000, 100_000]
+
+
+# ---------------- TRACES ----------------
+def synthetic_trace(scans, drugs, patients, seed=0):
+    """Cart-scanner scans in every context with delivery pairs mixed in."""
+    rng = random.Random(seed)
+    trace = []
+    while len(trace) < scans:
+        if rng.random() < 0.1:
+            p = rng.randrange(patients)
+            trace.append(("delivery", None, f"P{p:05d}"))
+            trace.append(("delivery", None, f"B{p % drugs:06d}"))
+        else:
+            trace.append(("cart", rng.choice(CONTEXTS), f"B{rng.randrange(drugs):06d}"))
+    return trace[:scans]
+
+
+def load_trace(path):
+    with open(path, newline="") as f:
+        return [(r["kind"], r.get("context") or None, r["code"]) for r in csv.DictReader(f)]
+
+
+def stock_csv(drugs, amount=1_000_000):
+    lines = ["Drug,Barcode,Needs_Waste,Cabinet,Section,Amount"]
+    lines += [f"Drug{i},B{i:06d},{i % 2 == 0},{i % 5 + 1},1,{amount}" for i in range(drugs)]
+    return "\n".join(lines)
+
+
+def upload(text, name="stock.csv"):
+    bio = io.BytesIO(text.encode())
+    bio.name = name
+    return bio
+
+
+# ---------------- LATENCY ----------------
+class UnlockClock:
+    """Matches each unlocking scan to the Pico's replies, per cabinet in order.
+
+    "Unlocking cabinet N" (the firmware got the command) gives scan→ack;
+    "Unlocked cabinet N" (the servo finished moving) gives scan→unlock.
+    """
+
+    def __init__(self):
+        self.waiting = {}     # cabinet -> deque of scan start times, not yet acked
+        self.moving = {}      # cabinet -> deque of scan start times, acked, not yet unlocked
+        self.ack_latencies = []
+        self.unlock_latencies = []
+        self._lock = threading.Lock()
+
+    def expect(self, cabinet, started):
+        with self._lock:
+            self.waiting.setdefault(cabinet, deque()).append(started)
+
+    def on_reply(self, line):
+        ack = REPLY_ACK.match(line)
+        done = None if ack else REPLY_DONE.match(line)
+        m = ack or done
+        if not m or m.group(1) != "Unlock":
+            return
+        now = time.monotonic()
+        cabinet = int(m.group(2))
+        with self._lock:
+            if ack:
+                q = self.waiting.get(cabinet)
+                if q:
+                    started = q.popleft()
+                    self.ack_latencies.append(now - started)
+                    self.moving.setdefault(cabinet, deque()).append(started)
+            else:
+                q = self.moving.get(cabinet)
+                if q:
+                    self.unlock_latencies.append(now - q.popleft())
+
+    def retract(self, cabinet):
+        """Forget the newest expectation (the scan did not unlock after all)."""
+        with self._lock:
+            self.waiting[cabinet].pop()
+
+    def pending(self):
+        """Scans still waiting for their ack or their unlock."""
+        with self._lock:
+            return sum(len(q) for q in self.waiting.values()) + sum(len(q) for q in self.moving.values())
+
+
+def percentiles(values):
+    if len(values) < 2:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    q = statistics.quantiles(values, n=100)
+    return {"p50_ms": q[49] * 1000, "p99_ms": q[98] * 1000, "max_ms": max(values) * 1000}
+
+
+# ---------------- SCENARIOS ----------------
+def replay(cart, trace, rate, clock):
+    """Feed the trace to the cart like the Streamlit handlers do, optionally paced."""
+    inv = cart.inventory
+    awaiting_patient = None
+    handled = {"ok": 0, "rejected": 0}
+    scan_times = []
+    t0 = time.monotonic()
+    for i, (kind, context, code) in enumerate(trace):
+        if rate:
+            delay = t0 + i / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        started = time.monotonic()
+        if kind == "delivery":
+            # handle_delivery_scan: patient first, then drug
+            if awaiting_patient is None:
+                if cart.has_patient(code):
+                    awaiting_patient = code
+                    result = None
+                else:
+                    result = ("warning", "unknown patient")
+            else:
+                result = cart.deliver(awaiting_patient, code)
+                awaiting_patient = None
+        else:
+            # expect the unlock before scanning so a fast reply is never missed
+            row = inv.find(code)
+            cabinet = inv.cabinet(row) if row is not None and context in UNLOCKING else None
+            if cabinet is not None:
+                clock.expect(cabinet, started)
+            result = cart.scan(code, context)
+            if cabinet is not None and (result is not None or not cart.link.connected):
+                clock.retract(cabinet)
+        scan_times.append(time.monotonic() - started)
+        handled["ok" if result is None else "rejected"] += 1
+    elapsed = time.monotonic() - t0
+    return elapsed, scan_times, handled
+
+
+def bench_scans(registry, trace, rate, drugs, patients, settle):
+    cart = registry.get("scan")
+    cart.import_inventory(read_table_chunks(upload(stock_csv(drugs))), "stock.csv")
+    pat = "Patient,Drug\n" + "\n".join(f"P{p:05d},Drug{p % drugs}" for p in range(patients))
+    cart.import_patients(read_table_chunks(upload(pat, "patients.csv")), "patients.csv")
+
+    clock = UnlockClock()
+    cart.link.listeners.append(clock.on_reply)
+    deadline = time.monotonic() + 5
+    while not cart.link.connected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(settle)   # let the restock unlock-all replies (ack and move) go by
+
+    elapsed, scan_times, handled = replay(cart, trace, rate, clock)
+    deadline = time.monotonic() + 5 + settle
+    while clock.pending() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return {
+        "scans": len(trace),
+        "target_rate": rate or None,
+        "scans_per_sec": len(trace) / elapsed,
+        "handled": handled,
+        "handler_latency": percentiles(scan_times),
+        "scan_to_ack": dict(percentiles(clock.ack_latencies), samples=len(clock.ack_latencies)),
+        "scan_to_unlock": dict(percentiles(clock.unlock_latencies), samples=len(clock.unlock_latencies)),
+        "unmatched": clock.pending(),
+        "pico_connected": cart.link.connected,
+    }
+
+
+def bench_imports(registry, sizes):
+    out = []
+    for n in sizes:
+        text = stock_csv(n, amount=10)
+        cart = registry.get(f"import{n}")
+        t = time.perf_counter()
+        report = cart.import_inventory(read_table_chunks(upload(text)), "stock.csv")
+        out.append({"rows": n, "bytes": len(text), "seconds": time.perf_counter() - t,
+                    "inserted": report.inserted})
+    return out
+
+
+def bench_memory(sizes):
+    out = []
+    for n in sizes:
+        frame = normalize_inventory(pd.read_csv(io.StringIO(stock_csv(n)), dtype=str), ImportReport())
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        inv = InventoryStore()
+        inv.merge_frame(frame)
+        gc.collect()
+        used, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        out.append({"rows": n, "retained_bytes": used - base, "peak_bytes": peak - base,
+                    "bytes_per_row": (used - base) / n})
+        del inv
+    return out
+
+
+# ---------------- REPORTING ----------------
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def summary_rows(results):
+    scan = results["scan"]
+    yield "scans/s", scan["scans_per_sec"]
+    yield "handler p50 ms", scan["handler_latency"]["p50_ms"]
+    yield "handler p99 ms", scan["handler_latency"]["p99_ms"]
+    ack = scan.get("scan_to_ack", {})     # missing from results written before it was measured
+    yield "scan→ack p50 ms", ack.get("p50_ms")
+    yield "scan→ack p99 ms", ack.get("p99_ms")
+    yield "scan→unlock p50 ms", scan["scan_to_unlock"]["p50_ms"]
+    yield "scan→unlock p99 ms", scan["scan_to_unlock"]["p99_ms"]
+    for r in results["import"]:
+        yield f"import {r['rows']} rows s", r["seconds"]
+    for r in results["memory"]:
+        yield f"memory {r['rows']} rows B/row", r["bytes_per_row"]
+
+
+def fmt(v):
+    return "-" if v is None else f"{v:,.3f}"
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = dict(summary_rows(json.load(f)))
+    with open(new_path) as f:
+        new = dict(summary_rows(json.load(f)))
+    print(f"{'metric':<28} {'old':>14} {'new':>14}")
+    for key in new:
+        print(f"{key:<28} {fmt(old.get(key)):>14} {fmt(new[key]):>14}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--trace", help="recorded trace CSV (default: synthetic)")
+    ap.add_argument("--scans", type=int, default=5_000, help="synthetic trace length")
+    ap.add_argument("--rate", type=float, default=0, help="scans per second (0 = as fast as possible)")
+    ap.add_argument("--drugs", type=int, default=10_000)
+    ap.add_argument("--patients", type=int, default=1_000)
+    ap.add_argument("--pico", default="sim", help="'sim' (pty simulator), 'loop://', or a serial port")
+    ap.add_argument("--move-sec", type=float, default=1.0, help="servo move time (simulated, or expected)")
+    ap.add_argument("--import-sizes", type=int, nargs="*", default=IMPORT_SIZES)
+    ap.add_argument("--memory-sizes", type=int, nargs="*", default=MEMORY_SIZES)
+    ap.add_argument("--no-metrics", action="store_true", help="disable tracing and metrics (see metrics.py)")
+    ap.add_argument("--metrics-file", help="also write the trace file (Pico round trips per scan)")
+    ap.add_argument("--out", default="loadgen_results.json")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    exporter = metrics.configure(enable=not args.no_metrics, path=args.metrics_file)
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(args.scans, args.drugs, args.patients)
+    sim = SimPico(move_sec=args.move_sec).start() if args.pico == "sim" else None
+    port = sim.port if sim else args.pico
+
+    with tempfile.TemporaryDirectory() as workdir:
+        ids = ["scan"] + [f"import{n}" for n in args.import_sizes]
+        registry = CartRegistry(
+            {cid: port for cid in ids}, baudrate=115200, num_cabinets=5, auto_relock_seconds=20,
+            out_warning_minutes=5, log_path=os.path.join(workdir, "{cart}.sqlite3"), default_patients={},
+        )
+        results = {
+            "meta": {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "git": git_rev(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "pico": "sim" if sim else args.pico,
+                "trace": args.trace or f"synthetic:{args.scans}",
+                "drugs": args.drugs,
+                "patients": args.patients,
+                "metrics": not args.no_metrics,
+                "metrics_file": bool(args.metrics_file),
+            },
+            "scan": bench_scans(registry, trace, args.rate, args.drugs, args.patients, args.move_sec + 0.3),
+            "import": bench_imports(registry, args.import_sizes),
+            "memory": bench_memory(args.memory_sizes),
+        }
+        registry.timers.stop()
+    if sim:
+        sim.stop()
+    if exporter is not None:
+        exporter.stop()
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    for key, value in summary_rows(results):
+        print(f"{key:<28} {fmt(value):>14}")
+    print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
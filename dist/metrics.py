@@ -0,0 +1,486 @@
+# metrics.py — Low-overhead tracing spans, counters and latency histograms for the hot paths
+import bisect
+import contextvars
+import cProfile
+import heapq
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# latency buckets in seconds: 100 µs (a scan) up to 10 s (a stuck Pico)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_SPAN_SEC = 0.25        # spans at least this slow are written to the trace file
+FILE_FLUSH_SEC = 1.0        # how often queued trace records go to the file
+FILE_SNAPSHOT_SEC = 60.0    # how often a full metrics snapshot goes to the file
+FILE_MAX_BYTES = 5_000_000
+FILE_BACKUPS = 3
+MAX_PENDING_EVENTS = 10_000  # trace records kept while the file writer catches up
+PROFILE_EVERY = 20          # profile one rerun in this many
+PROFILE_KEEP = 5            # slowest profiled reruns kept on disk
+
+# name -> (help, label names); label values are passed positionally, in this order
+METRICS = {
+    "cartos_scan_rejects_total": ("Scans answered with an error, warning or info message.",
+                                  ("cart", "context", "level")),
+    "cartos_errors_total": ("Failures, by where they happened.", ("where",)),
+    "cartos_pico_reconnects_total": ("Serial connections opened to a Pico.", ("port",)),
+    "cartos_pico_connected": ("1 while the Pico link is up.", ("port",)),
+    "cartos_timers_pending": ("Relock and overdue timers waiting to fire.", ()),
+    "cartos_span_seconds": ("Time spent in instrumented code paths; the scan span's _count is scans handled.",
+                            ("span",)),
+    "cartos_pico_ack_seconds": ("Command queued until the Pico acknowledged it (Unlocking / Locking).",
+                                ("command",)),
+    "cartos_pico_move_seconds": ("Command queued until the Pico reported the move done (Unlocked / Locked).",
+                                 ("command",)),
+}
+# labels each span carries after its name
+SPAN_LABELS = {
+    "scan": ("cart", "context"),
+    "inventory": ("op",),
+    "timer": ("kind",),
+    "render": ("part",),
+}
+
+enabled = True
+tracing = False     # a trace file is configured: queue records and correlate Pico replies
+_trace_id = contextvars.ContextVar("cartos_trace_id", default=None)
+_ids = itertools.count(1)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Shard:
+    """One thread's counters and histograms; only that thread writes to it."""
+
+    __slots__ = ("thread", "counters", "histograms")
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}
+        self.histograms = {}
+
+
+class Registry:
+    """Counters, histograms and gauges, exported in Prometheus text format.
+
+    Series are keyed by ``(name, label values)``. Each thread records into
+    its own shard, so the hot path takes no lock; shards are summed only
+    when scraped, and the shards of finished threads are folded into a
+    retired total.
+    """
+
+    def __init__(self):
+        self.gauges = {}        # (name, label values) -> fn() returning a number
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard(None)
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = self._local.shard = _Shard(threading.current_thread())
+        with self._lock:
+            # a new thread is the moment to let go of finished ones, so
+            # short-lived threads never pile up between scrapes
+            self._retire_dead()
+            self._shards.append(shard)
+        return shard
+
+    def _retire_dead(self):
+        """Fold the shards of finished threads into the retired total (holding _lock)."""
+        live = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                live.append(shard)
+            else:
+                _merge(self._retired, shard.counters, shard.histograms)
+        self._shards = live
+
+    def inc(self, key, n=1):
+        try:
+            counters = self._local.shard.counters
+        except AttributeError:
+            counters = self._shard().counters
+        counters[key] = counters.get(key, 0) + n
+
+    def observe(self, key, seconds):
+        try:
+            histograms = self._local.shard.histograms
+        except AttributeError:
+            histograms = self._shard().histograms
+        h = histograms.get(key)
+        if h is None:
+            h = histograms[key] = Histogram()
+        h.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        h.sum += seconds
+        h.count += 1
+
+    def _collect(self):
+        merged = _Shard(None)
+        with self._lock:
+            self._retire_dead()
+            _merge(merged, self._retired.counters, self._retired.histograms)
+            for shard in self._shards:
+                # dict() copies are atomic, so the owner thread can keep writing
+                _merge(merged, dict(shard.counters), dict(shard.histograms))
+        gauges = {}
+        for key, fn in list(self.gauges.items()):
+            try:
+                gauges[key] = float(fn())
+            except Exception:
+                pass
+        return merged.counters, merged.histograms, gauges
+
+    def prometheus(self):
+        counters, histograms, gauges = self._collect()
+        lines = []
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({k[0] for k in series}):
+                _header(lines, name, kind)
+                for key, value in sorted(series.items()):
+                    if key[0] == name:
+                        lines.append(f"{name}{_labels(key)} {value:g}")
+        for name in sorted({k[0] for k in histograms}):
+            _header(lines, name, "histogram")
+            for key, h in sorted(histograms.items(), key=lambda item: item[0]):
+                if key[0] != name:
+                    continue
+                running = 0
+                for le, c in zip(BUCKETS + ("+Inf",), h.counts):
+                    running += c
+                    lines.append(f"{name}_bucket{_labels(key, le=le)} {running}")
+                lines.append(f"{name}_sum{_labels(key)} {h.sum:.6f}")
+                lines.append(f"{name}_count{_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Flat ``{"name{labels}": value}`` view for the trace file."""
+        counters, histograms, gauges = self._collect()
+        flat = {f"{key[0]}{_labels(key)}": v for key, v in {**counters, **gauges}.items()}
+        for key, h in histograms.items():
+            flat[f"{key[0]}_count{_labels(key)}"] = h.count
+            flat[f"{key[0]}_sum{_labels(key)}"] = round(h.sum, 6)
+        return flat
+
+
+def _merge(into, counters, histograms):
+    for key, value in counters.items():
+        into.counters[key] = into.counters.get(key, 0) + value
+    for key, h in histograms.items():
+        total = into.histograms.get(key)
+        if total is None:
+            total = into.histograms[key] = Histogram()
+        total.counts = [a + b for a, b in zip(total.counts, list(h.counts))]
+        total.sum += h.sum
+        total.count += h.count
+
+
+def _header(lines, name, kind):
+    lines.append(f"# HELP {name} {METRICS[name][0]}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _labels(key, le=None):
+    name, values = key
+    names = METRICS[name][1]
+    if name == "cartos_span_seconds":
+        names = names + SPAN_LABELS.get(values[0], ())
+    pairs = list(zip(names, values))
+    if le is not None:
+        pairs.append(("le", le))
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = Registry()
+_events = deque(maxlen=MAX_PENDING_EVENTS)
+
+
+# ---------------- RECORDING ----------------
+def inc(name, *labels, n=1):
+    """Add ``n`` to a counter; ``labels`` are the values for METRICS[name]'s label names."""
+    if enabled:
+        registry.inc((name, labels), n)
+
+
+def observe(name, seconds, *labels):
+    if enabled:
+        registry.observe((name, labels), seconds)
+
+
+def gauge(name, fn, *labels):
+    """Register ``fn()`` to be read at every scrape."""
+    registry.gauges[(name, labels)] = fn
+
+
+def event(kind, **fields):
+    """Queue one JSON record for the rotating trace file (dropped when there is none)."""
+    if tracing:
+        fields["event"] = kind
+        fields["ts"] = round(time.time(), 6)
+        _events.append(fields)
+
+
+def new_trace_id():
+    return f"{next(_ids):x}"
+
+
+def current_trace():
+    """Correlation ID of the scan (or rerun) this thread is handling, if any."""
+    return _trace_id.get()
+
+
+class Span:
+    """``with span(...)``: time a block into ``cartos_span_seconds``.
+
+    A span that raises counts as an error for its name; a span slower than
+    SLOW_SPAN_SEC is written to the trace file with its correlation ID.
+    ``root=True`` starts a new correlation ID unless one is already active.
+    """
+
+    __slots__ = ("key", "root", "start", "_token")
+
+    def __init__(self, key, root):
+        self.key = key
+        self.root = root
+        self._token = None
+
+    def __enter__(self):
+        if self.root and _trace_id.get() is None:
+            self._token = _trace_id.set(new_trace_id())
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        registry.observe(self.key, elapsed)
+        if exc_type is not None:
+            registry.inc(("cartos_errors_total", (self.key[1][0],)))
+        if elapsed >= SLOW_SPAN_SEC:
+            event("slow_span", span=self.key[1][0], labels=list(self.key[1][1:]), ms=round(elapsed * 1000, 3),
+                  trace=_trace_id.get())
+        if self._token is not None:
+            _trace_id.reset(self._token)
+            self._token = None
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, *labels, root=False):
+    """Time a block; ``labels`` are the values for SPAN_LABELS[name]."""
+    if not enabled:
+        return _NO_SPAN
+    return Span(("cartos_span_seconds", (name,) + labels), root)
+
+
+def trace(name, *labels):
+    """A span that starts the correlation ID followed down to the Pico's reply.
+
+    Without a trace file nothing reads the ID, so it is a plain span.
+    """
+    if not enabled:
+        return _NO_SPAN
+    return Span(("cartos_span_seconds", (name,) + labels), tracing)
+
+
+# ---------------- RERUN PROFILING ----------------
+class Rerun:
+    """Times one Streamlit script run as the ``render`` span.
+
+    With profiling configured, one run in PROFILE_EVERY runs under cProfile
+    and the PROFILE_KEEP slowest of those are kept as ``.prof`` files
+    (open them with ``python -m pstats`` or snakeviz). Only one run is
+    profiled at a time. ``finish()`` is idempotent; call it before
+    ``st.stop()`` / ``st.rerun()``, which end the script early.
+
+    Every run gets a fresh correlation ID, so scans handled during the run
+    (and their Pico commands) are traced under it.
+    """
+
+    def __init__(self, part="page"):
+        self.done = not enabled
+        if self.done:
+            return
+        self.trace_id = new_trace_id()
+        self._token = _trace_id.set(self.trace_id)
+        self.span = span("render", part)
+        self.profile = _profiler.begin()
+        self.span.__enter__()
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        self.span.__exit__(None, None, None)
+        if self.profile is not None:
+            _profiler.end(self.profile, time.perf_counter() - self.span.start, self.trace_id)
+        try:
+            _trace_id.reset(self._token)
+        except ValueError:      # finished from another context; nothing to restore
+            pass
+
+
+class _RerunProfiler:
+    def __init__(self):
+        self.directory = None
+        self.active = None      # the one cProfile.Profile running, if any
+        self.kept = []          # min-heap of (seconds, path)
+        self._runs = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        if self.directory is None or not enabled:
+            return None
+        with self._lock:
+            if self.active is not None:
+                # a profiled run that ended without finish() (exception); drop it
+                self.active.disable()
+                self.active = None
+            self._runs += 1
+            if self._runs % PROFILE_EVERY:
+                return None
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:      # another profiler is active in this process
+                return None
+            self.active = prof
+            return prof
+
+    def end(self, prof, seconds, trace_id):
+        with self._lock:
+            prof.disable()
+            if self.active is prof:
+                self.active = None
+            if len(self.kept) >= PROFILE_KEEP and seconds <= self.kept[0][0]:
+                return
+            path = os.path.join(self.directory, f"rerun_{int(seconds * 1000):06d}ms_{trace_id}.prof")
+            prof.dump_stats(path)
+            heapq.heappush(self.kept, (seconds, path))
+            if len(self.kept) > PROFILE_KEEP:
+                _, evicted = heapq.heappop(self.kept)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+        event("profile", path=path, ms=round(seconds * 1000, 3), trace=trace_id)
+
+
+_profiler = _RerunProfiler()
+
+
+# ---------------- EXPORT ----------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Exporter:
+    """Serves ``/metrics`` on localhost and writes the rotating trace file.
+
+    The file gets one JSON object per line: queued trace records (Pico
+    round trips with their correlation ID, slow spans, reconnects, kept
+    profiles) every FILE_FLUSH_SEC, and a full metrics snapshot every
+    FILE_SNAPSHOT_SEC.
+    """
+
+    def __init__(self, port=None, path=None, host="127.0.0.1"):
+        self.server = None
+        self.logger = None
+        self._stop = threading.Event()
+        if port is not None:
+            try:
+                self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:    # e.g. a second server process on the same machine
+                event("metrics_endpoint_error", port=port, error=str(e))
+            else:
+                self.server.daemon_threads = True
+                threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        if path is not None:
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=FILE_MAX_BYTES,
+                                                           backupCount=FILE_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger = logging.getLogger(f"cartos.metrics.{path}")
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            self.logger.addHandler(handler)
+            threading.Thread(target=self._write_file, name="metrics-file", daemon=True).start()
+
+    def _write_file(self):
+        next_snapshot = time.monotonic() + FILE_SNAPSHOT_SEC
+        while not self._stop.wait(FILE_FLUSH_SEC):
+            self.flush()
+            if time.monotonic() >= next_snapshot:
+                next_snapshot += FILE_SNAPSHOT_SEC
+                self.logger.info(json.dumps({"event": "metrics", "ts": round(time.time(), 3),
+                                             "values": registry.snapshot()}))
+
+    def flush(self):
+        while _events:
+            self.logger.info(json.dumps(_events.popleft(), default=str))
+
+    def stop(self):
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.logger is not None:
+            self.flush()
+            for handler in self.logger.handlers:
+                handler.close()
+
+
+def configure(enable=True, port=None, path=None, profile_dir=None):
+    """Turn recording on or off and start the exporters; returns the Exporter.
+
+    Trace records and the per-command Pico round trips are only kept when
+    ``path`` is given; without a trace file only counters and histograms
+    are recorded.
+    """
+    global enabled, tracing
+    enabled = enable
+    tracing = enable and path is not None
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+    _profiler.directory = profile_dir
+    if not enable:
+        return None
+    return Exporter(port, path)
@@ -0,0 +1,242 @@
+# pico_link.py — Background serial worker for the Pico cabinet controller
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+import serial
+
+import metrics
+
+POLL_SEC = 0.02             # how long the worker waits for a command before reading replies
+RECONNECT_MIN_SEC = 0.5
+RECONNECT_MAX_SEC = 10.0
+MAX_REPLY_LINES = 50        # recent Pico lines kept for display
+MAX_BATCH = 16              # commands per write; replies are read between batches
+WRITE_TIMEOUT_SEC = 2.0     # a Pico that stops reading is treated as disconnected
+
+# firmware replies (servo.py) that tell us the real cabinet state
+REPLY_UNLOCKED = re.compile(r"^Unlock(?:ing|ed) cabinet (\d+)")
+REPLY_LOCKED = re.compile(r"^(?:Auto-locking|Locking|Locked) cabinet (\d+)")
+# acknowledgement / completion of one of our commands, for correlating replies
+REPLY_ACK = re.compile(r"^(Unlock|Lock)ing cabinet (\d+)")
+REPLY_DONE = re.compile(r"^(Unlock|Lock)ed cabinet (\d+)")
+MAX_INFLIGHT = 64           # sends of one command awaiting a reply before the oldest is forgotten
+
+
+class PicoLink:
+    """One long-lived worker thread per serial port.
+
+    The worker owns the ``serial.Serial`` handle and reconnects with
+    exponential backoff. It writes queued commands, coalescing everything
+    queued at the same moment into a single write. It also parses Pico
+    replies into ``cabinet_locked``. Callers only ever touch the queue,
+    so they never block on serial I/O.
+
+    The firmware protocol has no request IDs, so each UNLOCKn / LOCKn is
+    matched to its replies in order, per command. The command keeps the
+    correlation ID of the scan that sent it (see metrics.trace), and its
+    round trip is written to the trace file under that ID. Without a trace
+    file none of this bookkeeping is done.
+    """
+
+    def __init__(self, port, baudrate, num_cabinets):
+        self.port = port
+        self.baudrate = baudrate
+        self.cabinet_locked = {i + 1: True for i in range(num_cabinets)}
+        self.replies = []
+        self.listeners = []         # fn(line) called from the worker for every Pico line
+        self.connected = False
+        self.reconnects = 0
+        self._queue = queue.Queue()     # (generation, commands) batches
+        self._generation = 0            # bumped on every disconnect
+        self._state_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._ser = None
+        self._rx = bytearray()
+        self._outbox = []
+        self._awaiting_ack = {}     # "UNLOCK3" -> deque of (trace id, queued at)
+        self._awaiting_done = {}    # "UNLOCK3" -> deque of (trace id, queued at, acked at)
+        metrics.gauge("cartos_pico_connected", lambda: self.connected, port)
+
+    # ---------------- CALLER SIDE ----------------
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"pico-{self.port}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def send(self, *cmds):
+        """Queue one or more commands to go out in a single write.
+
+        Returns False (and drops the commands) while the port is down. Each
+        batch is tagged with the connection it was queued for, and the
+        worker discards batches from an earlier connection, so a stale
+        UNLOCK is never replayed after a reconnect.
+        """
+        with self._state_lock:
+            if not self.connected:
+                metrics.inc("cartos_errors_total", "pico_offline")
+                return False
+            if metrics.tracing:
+                trace_id = metrics.current_trace() or metrics.new_trace_id()
+                now = time.perf_counter()
+                for cmd in cmds:
+                    self._awaiting_ack.setdefault(cmd, deque(maxlen=MAX_INFLIGHT)).append((trace_id, now))
+            self._queue.put((self._generation, cmds))
+        return True
+
+    # ---------------- WORKER SIDE ----------------
+    def _run(self):
+        delay = RECONNECT_MIN_SEC
+        while not self._stop.is_set():
+            if self._ser is None:
+                try:
+                    self._open()
+                except (serial.SerialException, OSError, ValueError):
+                    metrics.inc("cartos_errors_total", "pico_open")
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, RECONNECT_MAX_SEC)
+                    continue
+                delay = RECONNECT_MIN_SEC
+            try:
+                self._write_pending()
+                self._read_replies()
+            except (serial.SerialException, OSError) as e:
+                metrics.inc("cartos_errors_total", "pico_io")
+                metrics.event("pico_error", port=self.port, error=str(e))
+                self._drop()
+        self._drop()
+
+    def _open(self):
+        ser = serial.serial_for_url(self.port, self.baudrate, timeout=0, write_timeout=WRITE_TIMEOUT_SEC)
+        try:
+            ser.write(b"CONNECT\n")
+        except Exception:
+            # a Pico that will not take the greeting is retried like a failed open
+            ser.close()
+            raise
+        self._ser = ser
+        self.reconnects += 1
+        with self._state_lock:
+            self.connected = True
+        metrics.inc("cartos_pico_reconnects_total", self.port)
+        metrics.event("pico_connect", port=self.port, reconnects=self.reconnects)
+
+    def _drop(self):
+        with self._state_lock:
+            # batches still queued for this connection are skipped by the writer
+            self.connected = False
+            self._generation += 1
+        if self._ser is not None:
+            try:
+                self._ser.close()
+            except Exception:
+                pass
+        self._ser = None
+        self._rx.clear()
+        # anything still queued was meant for the old connection
+        self._outbox = []
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._awaiting_ack.clear()
+        self._awaiting_done.clear()
+
+    def _take(self, block):
+        """Move one queued batch to the outbox; False when the queue is empty."""
+        try:
+            generation, cmds = self._queue.get(timeout=POLL_SEC) if block else self._queue.get_nowait()
+        except queue.Empty:
+            return False
+        if generation == self._generation:
+            self._outbox.extend(cmds)
+        return True
+
+    def _write_pending(self):
+        if not self._outbox and not self._take(block=True):
+            return
+        while self._take(block=False):
+            pass
+        if not self._outbox:
+            return
+        # bounded writes: the Pico blocks on its own replies if we never read them
+        batch, self._outbox = self._outbox[:MAX_BATCH], self._outbox[MAX_BATCH:]
+        self._ser.write("".join(c + "\n" for c in batch).encode())
+
+    def _read_replies(self):
+        waiting = self._ser.in_waiting
+        if not waiting:
+            return
+        self._rx += self._ser.read(waiting)
+        *lines, rest = self._rx.split(b"\n")
+        self._rx = bytearray(rest)
+        for raw in lines:
+            line = raw.decode(errors="replace").strip()
+            if line:
+                self._handle_reply(line)
+
+    def _handle_reply(self, line):
+        self.replies.append(line)
+        del self.replies[:-MAX_REPLY_LINES]
+        for fn in self.listeners:
+            try:
+                fn(line)
+            except Exception:
+                pass
+        if metrics.tracing:
+            self._correlate(line)
+        for pattern, locked in ((REPLY_UNLOCKED, False), (REPLY_LOCKED, True)):
+            m = pattern.match(line)
+            if m and int(m.group(1)) in self.cabinet_locked:
+                self.cabinet_locked[int(m.group(1))] = locked
+                return
+
+    def _correlate(self, line):
+        """Match an ack / completion to the oldest command still waiting for it."""
+        now = time.perf_counter()
+        m = REPLY_ACK.match(line)
+        if m:
+            cmd = m.group(1).upper() + m.group(2)
+            pending = self._awaiting_ack.get(cmd)
+            if pending:
+                trace_id, queued = pending.popleft()
+                metrics.observe("cartos_pico_ack_seconds", now - queued, m.group(1).upper())
+                self._awaiting_done.setdefault(cmd, deque(maxlen=MAX_INFLIGHT)).append((trace_id, queued, now))
+            return
+        m = REPLY_DONE.match(line)
+        if m:
+            cmd = m.group(1).upper() + m.group(2)
+            pending = self._awaiting_done.get(cmd)
+            if pending:
+                trace_id, queued, acked = pending.popleft()
+                metrics.observe("cartos_pico_move_seconds", now - queued, m.group(1).upper())
+                metrics.event("pico", trace=trace_id, port=self.port, cmd=cmd,
+                              ack_ms=round((acked - queued) * 1000, 3), done_ms=round((now - queued) * 1000, 3))
+
+
+# ---------------- PROCESS-WIDE REGISTRY ----------------
+_links = {}
+_links_lock = threading.Lock()
+
+
+def get_link(port, baudrate, num_cabinets):
+    """Return the running PicoLink for ``port``, creating it on first use."""
+    with _links_lock:
+        link = _links.get(port)
+        if link is None:
+            link = _links[port] = PicoLink(port, baudrate, num_cabinets)
+            link.start()
+        return link
@@ -0,0 +1,81 @@
+# sim_pico.py — Simulated Pico on a pseudo-terminal, speaking the servo.py protocol (Linux/macOS)
+import heapq
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+
+class SimPico:
+    """Stand-in for the servo.py firmware, for load tests and benchmarks.
+
+    Open ``sim.port`` like a real COM port. Commands are acknowledged on
+    receipt ("Unlocking cabinet N") and completed after ``move_sec``
+    ("Unlocked cabinet N"). Auto-lock and the LED are not simulated.
+    """
+
+    def __init__(self, num_cabinets=5, move_sec=1.0):
+        self.num_cabinets = num_cabinets
+        self.move_sec = move_sec
+        self.received = 0
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._done = []        # heap of (due, message)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"sim-pico-{self.port}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _reply(self, line):
+        os.write(self._master, (line + "\r\n").encode())
+
+    def _handle(self, cmd):
+        self.received += 1
+        for prefix, doing, done in (("UNLOCK", "Unlocking", "Unlocked"), ("LOCK", "Locking", "Locked")):
+            if cmd.startswith(prefix):
+                try:
+                    num = int(cmd[len(prefix):])
+                    if not 1 <= num <= self.num_cabinets:
+                        raise ValueError(f"no cabinet {num}")
+                except ValueError as e:
+                    self._reply(f"Invalid {prefix.lower()} command: {e}")
+                    return
+                self._reply(f"{doing} cabinet {num}")
+                heapq.heappush(self._done, (time.monotonic() + self.move_sec, f"{done} cabinet {num}"))
+                return
+        if cmd == "HELLO":
+            self._reply("HELLO from Pico")
+        else:
+            self._reply(f"Unknown command: {cmd}")
+
+    def _run(self):
+        buf = b""
+        while not self._stop.is_set():
+            wait = 0.05
+            if self._done:
+                wait = max(0.0, min(wait, self._done[0][0] - time.monotonic()))
+            ready, _, _ = select.select([self._master], [], [], wait)
+            if ready:
+                try:
+                    buf += os.read(self._master, 4096)
+                except OSError:
+                    return
+                *lines, buf = buf.split(b"\n")
+                for line in lines:
+                    cmd = line.decode(errors="replace").strip().upper()
+                    if cmd:
+                        self._handle(cmd)
+            now = time.monotonic()
+            while self._done and self._done[0][0] <= now:
+                self._reply(heapq.heappop(self._done)[1])
@@ -0,0 +1,52 @@
+# test_carts.py — Cart imports and the Add New form: bad input changes nothing
+# Run: python -m pytest test_carts.py
+import io
+
+import pandas as pd
+import pytest
+
+from carts import CartRegistry
+from importer import read_table_chunks
+from inventory import MAX_COUNT
+
+
+def upload(text, name="stock.csv"):
+    bio = io.BytesIO(text.encode())
+    bio.name = name
+    return bio
+
+
+@pytest.fixture
+def cart(tmp_path, monkeypatch):
+    monkeypatch.setattr("importer.CHUNK_ROWS", 2)   # several chunks for a few lines
+    registry = CartRegistry({"c": "loop://"}, baudrate=115200, num_cabinets=5, auto_relock_seconds=20,
+                            out_warning_minutes=5, log_path=str(tmp_path / "{cart}.sqlite3"), default_patients={})
+    yield registry.get("c")
+    registry.timers.stop()
+
+
+def test_unreadable_upload_changes_nothing(cart):
+    text = ("Drug,Barcode,Needs_Waste,Cabinet,Amount\n"
+            "A,BA,True,1,1\nB,BB,True,1,1\nC,BC,True,1,1\nD,BD,True,1,1\n"
+            'E,"BE,True,1,1\nF,BF,True,1,1\n')
+    with pytest.raises(pd.errors.ParserError):
+        cart.import_inventory(read_table_chunks(upload(text)), "stock.csv")
+    assert len(cart.inventory) == 0
+    assert cart.txlog.pending == 0 and cart.version == 0
+
+
+def test_unreadable_patients_upload_changes_nothing(cart):
+    text = 'Patient,Drug\nP1,A\nP2,B\nP3,C\nP4,"D\nP5,E\n'
+    with pytest.raises(pd.errors.ParserError):
+        cart.import_patients(read_table_chunks(upload(text, "patients.csv")), "patients.csv")
+    assert cart.patients == {} and cart.version == 0
+
+
+def test_add_new_refuses_amounts_the_store_cannot_hold(cart):
+    assert cart.add_new("A", "BA", MAX_COUNT + 1, False, 1, 1)[0] == "error"
+    assert cart.add_new("A", "BA", 5, False, 9, 1)[0] == "error"
+    assert len(cart.inventory) == 0
+    assert cart.add_new("A", "BA", MAX_COUNT - 1, False, 1, 1) is None
+    assert cart.add_new("A", "BA", 2, False, 1, 1)[0] == "error"
+    assert cart.add_new("A", "BA", 1, False, 1, 1) is None
+    assert cart.inventory.amount(cart.inventory.find("BA")) == MAX_COUNT
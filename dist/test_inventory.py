@@ -0,0 +1,73 @@
+# test_inventory.py — InventoryStore.merge_frame against the line-by-line upsert it replaces
+# Run: python -m pytest test_inventory.py
+import random
+
+import pandas as pd
+
+from inventory import MAX_COUNT, InventoryStore
+
+FIELDS = ["Drug", "Barcode", "Needs_Waste", "Cabinet", "Section", "Amount"]
+
+
+def frame(lines):
+    return pd.DataFrame(lines, columns=FIELDS)
+
+
+def random_lines(rng, n, drugs, barcodes, big=False):
+    return [(f"Drug{rng.randrange(drugs)}", f"B{rng.randrange(barcodes)}", rng.random() < 0.5,
+             rng.randint(1, 5), rng.randint(1, 3),
+             rng.randint(MAX_COUNT // 3, MAX_COUNT) if big and rng.random() < 0.5 else rng.randint(0, 20))
+            for _ in range(n)]
+
+
+def upsert_all(inv, lines):
+    overflow = []
+    for i, (drug, barcode, needs_waste, cabinet, section, amount) in enumerate(lines):
+        if inv.upsert(drug, barcode, amount, needs_waste, cabinet, section)[0] is None:
+            overflow.append(i)
+    return overflow
+
+
+def assert_same(a, b):
+    pd.testing.assert_frame_equal(a.to_dataframe(), b.to_dataframe())
+    assert a._by_barcode == b._by_barcode
+    assert a._by_drug == b._by_drug
+
+
+def test_drug_under_several_barcodes_takes_the_last_line():
+    inv = InventoryStore()
+    inv.merge_frame(frame([("Morphine", "M1", True, 1, 1, 5), ("Morphine", "M2", False, 2, 1, 5),
+                           ("Morphine", "M1", True, 3, 1, 5)]))
+    row = inv.find("M1")
+    assert row is not None and inv.find("M2") is None
+    assert (inv.amount(row), inv.needs_waste(row), inv.cabinet(row)) == (15, True, 3)
+
+
+def test_merge_frame_matches_sequential_upsert():
+    rng = random.Random(1)
+    for trial in range(200):
+        drugs, barcodes = rng.randint(1, 12), rng.randint(1, 12)
+        seed = random_lines(rng, rng.randint(0, 15), drugs, barcodes)
+        expected, actual = InventoryStore(), InventoryStore()
+        for line in seed:   # the same starting store, duplicate keys included
+            expected.insert(*line[:2], line[5], *line[2:5])
+            actual.insert(*line[:2], line[5], *line[2:5])
+        for _ in range(3):
+            before = len(actual)
+            lines = random_lines(rng, rng.randint(1, 40), drugs, barcodes, big=trial % 4 == 0)
+            overflow = upsert_all(expected, lines)
+            merged, inserted, new_rows, skipped = actual.merge_frame(frame(lines))
+            assert list(skipped) == overflow
+            assert merged + inserted + len(skipped) == len(lines)
+            assert new_rows == len(expected) - before
+            assert_same(actual, expected)
+
+
+def test_overflowing_lines_are_skipped_not_wrapped():
+    inv = InventoryStore()
+    _, _, _, overflow = inv.merge_frame(frame([("A", "B1", False, 1, 1, 2_000_000_000),
+                                               ("A", "B1", False, 2, 1, 2_000_000_000),
+                                               ("A", "B1", False, 3, 1, 7)]))
+    row = inv.find("B1")
+    assert list(overflow) == [1]
+    assert inv.amount(row) == 2_000_000_007 and inv.cabinet(row) == 3
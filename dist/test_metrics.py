@@ -0,0 +1,16 @@
+# test_metrics.py — Registry shards of finished threads are retired, not kept
+# Run: python -m pytest test_metrics.py
+import threading
+
+from metrics import Registry
+
+
+def test_short_lived_threads_do_not_pile_up_shards():
+    registry = Registry()
+    for _ in range(500):
+        t = threading.Thread(target=registry.inc, args=(("cartos_errors_total", ("test",)),))
+        t.start()
+        t.join()
+    assert len(registry._shards) <= 1       # only the newest, possibly still registered
+    counters, _, _ = registry._collect()
+    assert counters[("cartos_errors_total", ("test",))] == 500
@@ -0,0 +1,135 @@
+# test_pico_link.py — PicoLink over pyserial's loop:// port (writes come straight back as replies)
+# Run: python -m pytest test_pico_link.py
+import time
+
+import serial
+
+import pico_link
+from pico_link import PicoLink
+
+
+def opened_link():
+    """A link whose worker is not running; tests drive it step by step."""
+    link = PicoLink("loop://", 115200, num_cabinets=5)
+    link._open()
+    link._ser.reset_input_buffer()      # drop the CONNECT echo
+    return link
+
+
+def recorded_writes(link):
+    writes = []
+    real_write = link._ser.write
+
+    def write(data):
+        writes.append(data)
+        return real_write(data)
+
+    link._ser.write = write
+    return writes
+
+
+def test_queued_commands_coalesce_into_one_write():
+    link = opened_link()
+    writes = recorded_writes(link)
+    assert link.send("UNLOCK1")
+    assert link.send("UNLOCK2", "LOCK3")
+    assert link.send("UNLOCK4")
+    link._write_pending()
+    assert writes == [b"UNLOCK1\nUNLOCK2\nLOCK3\nUNLOCK4\n"]
+
+
+def test_replies_update_cabinet_state():
+    link = opened_link()
+    seen = []
+    link.listeners.append(seen.append)
+    link._ser.write(b"Unlocking cabinet 2\r\nUnlocked cabinet 4\r\nAuto-locking cabinet 4\r\n"
+                    b"Locked cabinet 1\r\nUnlocking cabinet 9\r\nHELLO from Pico\r\n")
+    link._read_replies()
+    assert link.cabinet_locked == {1: True, 2: False, 3: True, 4: True, 5: True}
+    assert seen == link.replies[-6:] and seen[-1] == "HELLO from Pico"
+
+
+def test_partial_reply_lines_wait_for_newline():
+    link = opened_link()
+    link._ser.write(b"Unlocking cab")
+    link._read_replies()
+    assert link.cabinet_locked[3] is True and link.replies == []
+    link._ser.write(b"inet 3\n")
+    link._read_replies()
+    assert link.cabinet_locked[3] is False
+
+
+def test_send_is_refused_while_disconnected():
+    link = opened_link()
+    link._drop()
+    assert link.send("UNLOCK1") is False
+
+
+def test_send_on_dead_port_returns_false():
+    link = PicoLink("/nonexistent/ttyACM9", 115200, num_cabinets=5)
+    link.start()
+    try:
+        time.sleep(0.1)
+        assert not link.connected
+        assert link.send("UNLOCK1") is False
+    finally:
+        link.stop()
+
+
+def test_batches_from_an_old_connection_are_not_replayed():
+    link = opened_link()
+    old_generation = link._generation
+    link._drop()
+    link._open()
+    writes = recorded_writes(link)
+    # a send() that raced the disconnect and queued for the old connection
+    link._queue.put((old_generation, ("UNLOCK1",)))
+    link.send("LOCK2")
+    link._write_pending()
+    assert writes == [b"LOCK2\n"]
+
+
+def test_worker_sends_and_parses_over_loop():
+    link = PicoLink("loop://", 115200, num_cabinets=5)
+    link.start()
+    try:
+        deadline = time.monotonic() + 2
+        while not link.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # loop:// echoes the command itself, which the link logs but does not parse as state
+        assert link.send("HELLO")
+        while "HELLO" not in link.replies and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert "HELLO" in link.replies
+        assert all(link.cabinet_locked.values())
+    finally:
+        link.stop()
+    assert not link.connected
+
+
+def test_failed_greeting_is_retried_like_a_failed_open(monkeypatch):
+    opened = []
+    real_serial_for_url = serial.serial_for_url
+
+    def serial_for_url(*args, **kwargs):
+        ser = real_serial_for_url("loop://", timeout=0)
+        if not opened:      # the first Pico stops reading: its CONNECT write times out
+            def stuck(data):
+                raise serial.SerialTimeoutException("Write timeout")
+            ser.write = stuck
+        opened.append(ser)
+        return ser
+
+    monkeypatch.setattr(pico_link.serial, "serial_for_url", serial_for_url)
+    monkeypatch.setattr(pico_link, "RECONNECT_MIN_SEC", 0.01)
+    link = PicoLink("fake", 115200, num_cabinets=5)
+    link.start()
+    try:
+        deadline = time.monotonic() + 2
+        while not link.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert link.connected and len(opened) == 2
+        assert not opened[0].is_open
+        assert link.send("HELLO")
+    finally:
+        link.stop()
@@ -0,0 +1,93 @@
+# test_timers.py — TimerService on a fake clock with thousands of timers
+# Run: python -m pytest test_timers.py
+import random
+
+import timers
+from timers import TimerService
+
+TIMERS = 5_000
+STEP = 0.5
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(svc, clock, until):
+    """Advance the fake clock in STEP increments, firing whatever is due."""
+    while clock.now < until:
+        clock.now += STEP
+        svc.run_due()
+        assert len(svc._heap) == len(svc) + svc._dead
+
+
+def test_thousands_of_timers_fire_once_on_time():
+    rng = random.Random(7)
+    clock = FakeClock()
+    svc = TimerService(clock)
+    fired = []
+    svc.subscribe(lambda key, data: fired.append((key, data, clock.now)))
+
+    expected = {}
+    for i in range(TIMERS):
+        expected[i] = rng.uniform(1, 1_000)
+        svc.schedule(i, expected[i], expected[i])
+    keys = list(expected)
+    rng.shuffle(keys)
+
+    cancelled = set(keys[:3_000])
+    for key in cancelled:
+        assert svc.cancel(key)
+        del expected[key]
+    assert not svc.cancel(keys[0])
+    # compaction ran: the heap no longer holds every cancelled entry
+    assert len(svc._heap) < TIMERS
+    assert len(svc._heap) == len(svc) + svc._dead
+
+    for key in keys[3_000:3_500]:
+        expected[key] = rng.uniform(1, 1_000)
+        svc.schedule(key, expected[key], expected[key])
+        assert svc.deadline(key) == expected[key]
+    assert len(svc) == len(expected)
+
+    run(svc, clock, 1_001)
+    fired_keys = [key for key, _, _ in fired]
+    assert len(fired_keys) == len(set(fired_keys))          # exactly once
+    assert set(fired_keys) == set(expected)                 # every live timer, no cancelled one
+    for key, data, at in fired:
+        assert data == expected[key]                        # the latest schedule wins
+        assert expected[key] <= at < expected[key] + STEP   # never early, and on the first due tick
+    assert len(svc) == 0 and svc._heap == [] and svc._dead == 0
+
+
+def test_reschedule_replaces_the_earlier_deadline():
+    clock = FakeClock()
+    svc = TimerService(clock)
+    fired = []
+    svc.subscribe(lambda key, data: fired.append((key, clock.now)))
+    for i in range(1_000):
+        svc.schedule(i, 10)
+        svc.schedule(i, 20 + i % 10)        # later deadline replaces 10
+    run(svc, clock, 19.5)
+    assert fired == []
+    run(svc, clock, 30)
+    assert sorted(key for key, _ in fired) == list(range(1_000))
+    assert all(at >= 20 + key % 10 for key, at in fired)
+
+
+def test_compaction_triggers_at_compact_min(monkeypatch):
+    monkeypatch.setattr(timers, "COMPACT_MIN", 100)
+    svc = TimerService(FakeClock())
+    for i in range(150):
+        svc.schedule(i, 1_000 + i)
+    for i in range(99):
+        svc.cancel(i)
+    assert len(svc._heap) == 150 and svc._dead == 99       # below COMPACT_MIN: entries stay
+    svc.cancel(99)
+    assert len(svc._heap) == 50 and svc._dead == 0         # 100 dead >= half the heap: rebuilt
+    assert all(entry[4] for entry in svc._heap)
+    assert svc.run_due(2_000) == 50
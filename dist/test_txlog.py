@@ -0,0 +1,75 @@
+# test_txlog.py — TxLog durability (shared files, failed commits, retries) and audit times
+# Run: python -m pytest test_txlog.py
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import txlog
+from txlog import TxLog
+
+
+def stock(log):
+    log.append("insert", drug="Aspirin", barcode="B1", amount=10, needs_waste=False, cabinet=1, section=1)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_two_handles_append_to_one_file(tmp_path):
+    path = str(tmp_path / "log.sqlite3")
+    a, b = TxLog(path), TxLog(path)
+    stock(a)
+    assert a.flush()
+    for _ in range(3):
+        a.append("dispense", barcode="B1", drug="Aspirin", when="2024-01-01 00:00:00")
+        b.append("dispense", barcode="B1", drug="Aspirin", when="2024-01-01 00:00:00")
+        assert a.flush() and b.flush()
+    assert a.last_error is None and b.last_error is None
+    inventory, _ = TxLog(path).recover({})
+    assert inventory.amount(inventory.find("B1")) == 4
+    a.close()
+    b.close()
+
+
+def test_failed_commit_keeps_the_batch_and_retries(tmp_path, monkeypatch):
+    monkeypatch.setattr(txlog, "BUSY_TIMEOUT_SEC", 0.05)
+    path = str(tmp_path / "log.sqlite3")
+    log = TxLog(path)
+    stock(log)
+    assert log.flush()
+
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN EXCLUSIVE")
+    log.append("dispense", barcode="B1", drug="Aspirin", when="2024-01-01 00:00:00")
+    assert wait_for(lambda: log.failures > 0)
+    assert "locked" in log.last_error
+    assert log.pending == 1
+    log.append("waste", barcode="B1", drug="Aspirin")   # appends keep working while the log is behind
+
+    blocker.execute("COMMIT")
+    blocker.close()
+    assert wait_for(lambda: log.pending == 0 and log.failures == 0, timeout=10)
+    assert log.last_error is None
+    kinds = [k for k in log.events_between(0, time.time() + 1)["Event"]]
+    assert kinds == ["insert", "dispense", "waste"]
+    log.close()
+
+
+def test_audit_times_are_local(tmp_path, monkeypatch):
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        log = TxLog(str(tmp_path / "log.sqlite3"))
+        stock(log)
+        when = log.events_between(time.time() - 60, time.time() + 1)["Time"].iloc[0]
+        assert when.utcoffset() in (timedelta(hours=-4), timedelta(hours=-5))
+        # local wall-clock time, the same clock the audit date picker's day boundaries use
+        assert abs((when.tz_localize(None) - datetime.now()).total_seconds()) < 60
+        log.close()
+    finally:
+        monkeypatch.undo()
+        time.tzset()
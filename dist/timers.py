@@ -0,0 +1,120 @@
+# timers.py — Process-wide deadline scheduler (min-heap) for relocks and overdue alerts
+import heapq
+import threading
+import time
+
+COMPACT_MIN = 1_024   # rebuild the heap once this many cancelled entries pile up...
+COMPACT_RATIO = 0.5   # ...and they are at least this share of the heap
+
+
+class TimerService:
+    """Fires keyed deadlines on time from one background thread.
+
+    ``schedule`` and ``cancel`` are O(log n) / O(1): cancelled entries stay
+    in the heap marked dead and are skipped when they reach the top (or
+    dropped in bulk when they pile up). Scheduling an existing key replaces
+    its deadline. Due timers are published to every subscriber as
+    ``fn(key, data)``.
+
+    ``clock`` is injectable; with a fake clock, call ``run_due()`` directly
+    instead of ``start()``.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._heap = []            # [deadline, counter, key, data, alive]
+        self._entries = {}         # key -> live heap entry
+        self._counter = 0
+        self._dead = 0
+        self._subscribers = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stop = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def subscribe(self, fn):
+        self._subscribers.append(fn)
+
+    # ---------------- SCHEDULING ----------------
+    def schedule(self, key, deadline, data=None):
+        with self._cond:
+            self._cancel(key)
+            self._counter += 1
+            entry = [deadline, self._counter, key, data, True]
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def cancel(self, key):
+        """Drop a pending timer. Returns True if one was pending."""
+        with self._cond:
+            return self._cancel(key)
+
+    def _cancel(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[4] = False
+        self._dead += 1
+        if self._dead >= COMPACT_MIN and self._dead >= COMPACT_RATIO * len(self._heap):
+            self._heap = [e for e in self._heap if e[4]]
+            heapq.heapify(self._heap)
+            self._dead = 0
+        return True
+
+    def deadline(self, key):
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    # ---------------- FIRING ----------------
+    def _pop_due(self, now):
+        due = []
+        heap = self._heap
+        while heap and (not heap[0][4] or heap[0][0] <= now):
+            entry = heapq.heappop(heap)
+            if not entry[4]:
+                self._dead -= 1
+                continue
+            del self._entries[entry[2]]
+            due.append(entry)
+        return due
+
+    def run_due(self, now=None):
+        """Fire every timer due at ``now`` (default: the clock). Returns the count."""
+        with self._cond:
+            due = self._pop_due(self.clock() if now is None else now)
+        for _, _, key, data, _ in due:
+            for fn in self._subscribers:
+                try:
+                    fn(key, data)
+                except Exception:
+                    pass
+        return len(due)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stop:
+                    return
+                wait = self._heap[0][0] - self.clock() if self._heap else None
+                if wait is None or wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            self.run_due()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="timer-service", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
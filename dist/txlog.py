@@ -0,0 +1,229 @@
+# txlog.py — Append-only SQLite (WAL) event log with snapshots for cart state
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+import pandas as pd
+from dateutil.tz import tzlocal
+
+import metrics
+from importer import ImportReport, merge_patients
+from inventory import InventoryStore
+
+FLUSH_SEC = 0.05          # group-commit window for appended events
+FLUSH_EVENTS = 500        # ...or flush early once this many are pending
+SNAPSHOT_EVERY = 5_000    # events between snapshots; bounds replay at startup
+KEEP_SNAPSHOTS = 2
+RETRY_MAX_SEC = 5.0       # longest wait between retries while the database refuses writes
+BUSY_TIMEOUT_SEC = 5.0    # how long one commit waits for another writer's lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq     INTEGER PRIMARY KEY,
+    ts      REAL NOT NULL,
+    kind    TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE TABLE IF NOT EXISTS snapshots (
+    seq   INTEGER PRIMARY KEY,
+    ts    REAL NOT NULL,
+    state BLOB NOT NULL
+);
+"""
+
+
+class TxLog:
+    """Durable record of every inventory/patient mutation.
+
+    ``append`` is cheap: events are buffered and a writer thread commits
+    them in one transaction every FLUSH_SEC (group commit). Startup loads
+    the newest snapshot and replays only the events after it.
+
+    SQLite assigns event sequence numbers, so several handles (or server
+    processes) can append to the same file. A failed commit (database
+    locked, disk full, ...) is rolled back and its batch kept for the next
+    attempt, retried with backoff; ``last_error`` says why the log is
+    behind until a commit succeeds again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SEC, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self.last_error = None
+        self.failures = 0           # consecutive failed commits
+        self._last_seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+        self._version = self._last_seq
+        row = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM snapshots").fetchone()
+        self._since_snapshot = self._db.execute(
+            "SELECT COUNT(*) FROM events WHERE seq > ?", (row[0],)).fetchone()[0]
+        self._writer = threading.Thread(target=self._run, name="txlog-writer", daemon=True)
+        self._writer.start()
+
+    @property
+    def pending(self):
+        """Events appended but not yet committed."""
+        return len(self._pending)
+
+    @property
+    def version(self):
+        """Bumped by every append in this process; a cheap state version."""
+        return self._version
+
+    # ---------------- WRITE ----------------
+    def append(self, kind, **payload):
+        """Queue one event for the writer thread."""
+        with self._pending_lock:
+            self._version += 1
+            self._since_snapshot += 1
+            self._pending.append((time.time(), kind, json.dumps(payload, default=str)))
+            if len(self._pending) >= FLUSH_EVENTS:
+                self._wake.set()
+
+    def flush(self):
+        """Commit everything queued so far. Returns False (batch kept) on failure."""
+        # the database lock spans swap and commit, so a flush that finds
+        # nothing queued also knows every earlier batch is committed
+        with self._db_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return True
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                self._db.executemany("INSERT INTO events (ts, kind, payload) VALUES (?, ?, ?)", batch)
+                last_seq = self._db.execute("SELECT last_insert_rowid()").fetchone()[0]
+                self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                try:
+                    if self._db.in_transaction:
+                        self._db.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                with self._pending_lock:
+                    self._pending[:0] = batch       # keep the original order ahead of newer events
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                metrics.inc("cartos_errors_total", "txlog")
+                metrics.event("txlog_error", path=self.path, error=self.last_error, pending=len(self._pending))
+                return False
+            self._last_seq = last_seq
+            self.failures = 0
+            self.last_error = None
+            return True
+
+    def _run(self):
+        while not self._closed:
+            # back off while the database keeps refusing writes
+            wait = FLUSH_SEC if not self.failures else min(FLUSH_SEC * 2 ** self.failures, RETRY_MAX_SEC)
+            self._wake.wait(wait)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._writer.join(timeout=2)
+        self.flush()
+        self._db.close()
+
+    # ---------------- SNAPSHOTS ----------------
+    def snapshot_due(self):
+        return self._since_snapshot >= SNAPSHOT_EVERY and not self.failures
+
+    def snapshot(self, inventory, patients):
+        """Store the state as of the last appended event.
+
+        Call it from the thread that mutates the state (holding its lock),
+        right after an append, so the snapshot matches the committed log.
+        Skipped while the log cannot be committed; it is retried later.
+        """
+        state = zlib.compress(json.dumps({
+            "inventory": inventory.snapshot(),
+            "patients": patients,
+        }, default=str).encode())
+        if not self.flush():
+            return
+        try:
+            with self._db_lock:
+                self._db.execute("INSERT OR REPLACE INTO snapshots (seq, ts, state) VALUES (?, ?, ?)",
+                                 (self._last_seq, time.time(), state))
+                self._db.execute(
+                    "DELETE FROM snapshots WHERE seq NOT IN "
+                    "(SELECT seq FROM snapshots ORDER BY seq DESC LIMIT ?)", (KEEP_SNAPSHOTS,))
+        except sqlite3.Error as e:
+            # events are safe; only startup replay gets longer until the next snapshot
+            metrics.inc("cartos_errors_total", "txlog_snapshot")
+            metrics.event("txlog_error", path=self.path, error=f"snapshot: {type(e).__name__}: {e}")
+            return
+        self._since_snapshot = 0
+
+    # ---------------- RECOVERY ----------------
+    def recover(self, default_patients):
+        """Rebuild ``(inventory, patients)`` from the newest snapshot plus later events."""
+        self.flush()
+        with self._db_lock:
+            row = self._db.execute("SELECT seq, state FROM snapshots ORDER BY seq DESC LIMIT 1").fetchone()
+            if row is None:
+                seq, inventory, patients = 0, InventoryStore(), default_patients
+            else:
+                seq, blob = row
+                state = json.loads(zlib.decompress(blob))
+                inventory = InventoryStore.from_snapshot(state["inventory"])
+                patients = state["patients"]
+            events = self._db.execute(
+                "SELECT kind, payload FROM events WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+        for kind, payload in events:
+            apply_event(inventory, patients, kind, json.loads(payload))
+        return inventory, patients
+
+    # ---------------- AUDIT ----------------
+    def events_between(self, start, end):
+        """Events with ``start <= ts < end`` (epoch seconds) as a DataFrame.
+
+        Times are in the server's local zone, with the UTC offset, so they
+        line up with the local days the audit export is picked by.
+        """
+        self.flush()
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT seq, ts, kind, payload FROM events WHERE ts >= ? AND ts < ? ORDER BY seq",
+                (start, end)).fetchall()
+        df = pd.DataFrame(rows, columns=["Seq", "Time", "Event", "Details"])
+        df["Time"] = pd.to_datetime(df["Time"], unit="s", utc=True).dt.tz_convert(tzlocal())
+        return df
+
+
+def apply_event(inventory, patients, kind, p):
+    """Replay one logged mutation. Mirrors what the app did when it logged it."""
+    if kind == "insert":
+        inventory.insert(p["drug"], p["barcode"], p["amount"], p["needs_waste"], p["cabinet"], p["section"])
+    elif kind == "merge":
+        inventory.merge_frame(pd.DataFrame(p["rows"], columns=p["columns"]))
+    elif kind == "patients":
+        merge_patients(patients, pd.DataFrame(p["rows"], columns=["Patient", "Drug"]), ImportReport())
+        return
+    else:
+        row = inventory.find(p["barcode"])
+        if row is None:
+            return
+        if kind == "add_units":
+            inventory.add_units(row, p["n"])
+        elif kind == "dispense":
+            inventory.dispense(row, p["when"])
+        elif kind == "return":
+            inventory.return_unit(row)
+        elif kind == "waste":
+            inventory.waste(row)
+        elif kind == "deliver":
+            inventory.deliver(row, p["patient"])
@@ -11,6 +11,29 @@ for s in servos:
 
 led = Pin("LED", Pin.OUT)
 
+MOVE_MS = 1000        # how long a servo spins for one unlock/lock
+AUTOLOCK_DELAY = 20   # seconds after unlock before auto-lock
+LED_STEP_MS = 200     # LED on/off time while flashing
+TICK_MS = 10          # main loop period
+MAX_READ = 256        # max serial chars taken per tick
+
+# MicroPython tick helpers; plain time fallbacks let this run on a desktop
+# Python with a stub `machine` module.
+ticks_ms = getattr(time, "ticks_ms", None) or (lambda: int(time.monotonic() * 1000))
+ticks_add = getattr(time, "ticks_add", None) or (lambda t, delta: t + delta)
+ticks_diff = getattr(time, "ticks_diff", None) or (lambda a, b: a - b)
+sleep_ms = getattr(time, "sleep_ms", None) or (lambda ms: time.sleep(ms / 1000))
+
+# -------------------------------
+# Per-servo state (None = idle)
+# -------------------------------
+move_dir = [None] * len(servos)       # "unlock" / "lock" while spinning
+move_deadline = [None] * len(servos)  # tick when the spin should stop
+autolock_at = [None] * len(servos)    # tick when an unlocked cabinet relocks
+
+led_steps = 0          # remaining LED on/off edges
+led_next = 0
+
 # -------------------------------
 # Helper functions
 # -------------------------------
@@ -23,8 +46,8 @@ def duty_us_to_u16(us):
     """Convert microseconds to 16-bit duty cycle at 50Hz (20ms period)."""
     return int((us / 20000) * 65535)
 
-def spin_servo(idx, direction, duration=1):
-    """Spin continuous servo at fixed speed for unlock/lock."""
+def start_spin(idx, direction, now, duration_ms=MOVE_MS):
+    """Start spinning a continuous servo; tick() stops it at its deadline."""
     if direction == "unlock":
         # Spin one direction (e.g. clockwise)
         servos[idx].duty_u16(duty_us_to_u16(500))
@@ -33,75 +56,127 @@ def spin_servo(idx, direction, duration=1):
         servos[idx].duty_u16(duty_us_to_u16(1980))
     else:
         servo_stop(idx)
+        move_dir[idx] = None
+        move_deadline[idx] = None
         return
 
-    time.sleep(duration)
-    servo_stop(idx)
+    move_dir[idx] = direction
+    move_deadline[idx] = ticks_add(now, duration_ms)
 
-def unlock_servo(idx):
+def unlock_servo(idx, now):
     print(f"Unlocking cabinet {idx+1}")
-    spin_servo(idx, "unlock", duration=1)
+    start_spin(idx, "unlock", now)
+    autolock_at[idx] = ticks_add(now, AUTOLOCK_DELAY * 1000)
 
-def lock_servo(idx):
+def lock_servo(idx, now):
     print(f"Locking cabinet {idx+1}")
-    spin_servo(idx, "lock", duration=1)
+    start_spin(idx, "lock", now)
+    autolock_at[idx] = None
 
 def flash_led(times=3):
-    for _ in range(times):
-        led.on()
-        time.sleep(0.2)
-        led.off()
-        time.sleep(0.2)
+    """Queue `times` LED flashes; tick() drives them."""
+    global led_steps, led_next
+    led_steps = times * 2
+    led_next = ticks_ms()
+
+def parse_cabinet(cmd, prefix):
+    num = int(cmd[len(prefix):]) - 1
+    if not 0 <= num < len(servos):
+        raise ValueError(f"no cabinet {num+1}")
+    return num
+
+def handle_command(cmd, now):
+    """Act on one command line. Replies are sent before any motion finishes."""
+    if cmd.startswith("UNLOCK"):
+        try:
+            unlock_servo(parse_cabinet(cmd, "UNLOCK"), now)
+        except Exception as e:
+            print("Invalid unlock command:", e)
+
+    elif cmd.startswith("LOCK"):
+        try:
+            lock_servo(parse_cabinet(cmd, "LOCK"), now)
+        except Exception as e:
+            print("Invalid lock command:", e)
+
+    elif cmd == "HELLO":
+        print("HELLO from Pico")
+        flash_led(2)
 
-# -------------------------------
-# Main setup
-# -------------------------------
-print("Pico continuous servo controller ready...")
-flash_led(3)
-
-buffer = ""
-last_unlock_time = [None] * len(servos)
-AUTOLOCK_DELAY = 20
-
-while True:
-    # --- read serial ---
-    if sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
-        data = sys.stdin.read(1)
-        if data == "\n":
-            cmd = buffer.strip().upper()
-            buffer = ""
-
-            if cmd.startswith("UNLOCK"):
-                try:
-                    num = int(cmd[-1]) - 1
-                    unlock_servo(num)
-                    last_unlock_time[num] = time.time()
-                except Exception as e:
-                    print("Invalid unlock command:", e)
-
-            elif cmd.startswith("LOCK"):
-                try:
-                    num = int(cmd[-1]) - 1
-                    lock_servo(num)
-                    last_unlock_time[num] = None
-                except Exception as e:
-                    print("Invalid lock command:", e)
-
-            elif cmd == "HELLO":
-                print("HELLO from Pico")
-                flash_led(2)
-
-            else:
-                print("Unknown command:", cmd)
-        else:
-            buffer += data
+    else:
+        print("Unknown command:", cmd)
 
-    # --- auto-lock check ---
-    now = time.time()
+def tick(now):
+    """Finish due motions, fire due auto-locks and step the LED."""
+    global led_steps, led_next
     for i in range(len(servos)):
-        if last_unlock_time[i] and now - last_unlock_time[i] > AUTOLOCK_DELAY:
+        if move_deadline[i] is not None and ticks_diff(now, move_deadline[i]) >= 0:
+            servo_stop(i)
+            print(f"{'Unlocked' if move_dir[i] == 'unlock' else 'Locked'} cabinet {i+1}")
+            move_dir[i] = None
+            move_deadline[i] = None
+
+        if autolock_at[i] is not None and ticks_diff(now, autolock_at[i]) >= 0:
             print(f"Auto-locking cabinet {i+1}")
-            lock_servo(i)
-            last_unlock_time[i] = None
+            lock_servo(i, now)
+
+    if led_steps and ticks_diff(now, led_next) >= 0:
+        if led_steps % 2 == 0:
+            led.on()
+        else:
+            led.off()
+        led_steps -= 1
+        led_next = ticks_add(now, LED_STEP_MS)
+
+# -------------------------------
+# Serial input (line buffered)
+# -------------------------------
+poller = select.poll()
+poller.register(sys.stdin, select.POLLIN)
+rx_parts = []
+
+if sys.implementation.name != "micropython":
+    # desktop Python: take everything that is waiting in one read
+    import os
+
+    def read_available():
+        if not poller.poll(0):
+            return ""
+        return os.read(sys.stdin.fileno(), MAX_READ).decode()
+else:
+    def read_available():
+        chars = []
+        while len(chars) < MAX_READ and poller.poll(0):
+            chars.append(sys.stdin.read(1))
+        return "".join(chars)
+
+def read_commands():
+    """Return complete command lines received since the last call."""
+    global rx_parts
+    data = read_available()
+    if not data:
+        return []
+    rx_parts.append(data)
+    if "\n" not in data:
+        return []
+    lines = "".join(rx_parts).split("\n")
+    rx_parts = [lines.pop()]
+    return [line.strip().upper() for line in lines if line.strip()]
+
+# -------------------------------
+# Main loop
+# -------------------------------
+
+def main():
+    print("Pico continuous servo controller ready...")
+    flash_led(3)
+
+    while True:
+        now = ticks_ms()
+        for cmd in read_commands():
+            handle_command(cmd, now)
+        tick(now)
+        sleep_ms(TICK_MS)
 
-    time.sleep(0.1)
+if __name__ == "__main__":
+    main()